@@ -9,12 +9,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
 
+import sys
 import json
 import os
 import datetime
+import hashlib
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import botocore
+import rule_runtime
 
 ##############
 # Parameters #
@@ -31,6 +36,27 @@ CODEPIPELINE_NAME = 'Compliance-Engine-Pipeline'
 # Name of the Firehose to record all evaluations of all the rules in all accounts
 FIREHOSE_NAME = 'Firehose-Compliance-Engine'
 
+# Limits of the Firehose PutRecordBatch API, and number of retries of the records which failed
+FIREHOSE_BATCH_MAX_RECORDS = 500
+FIREHOSE_BATCH_MAX_BYTES = 4 * 1024 * 1024
+FIREHOSE_BATCH_MAX_RETRIES = 5
+
+# Export of the evaluations to Firehose: FULL exports all the evaluations at each run. INCREMENTAL exports only the new or
+# changed evaluations since the last run, with a full export every FULL_EXPORT_INTERVAL_DAYS. The state of the last export
+# of each account is stored in the template bucket.
+EXPORT_MODE = os.environ.get('ExportMode', 'FULL')
+FULL_EXPORT_INTERVAL_DAYS = int(os.environ.get('FullExportIntervalDays', '7'))
+EXPORT_STATE_PREFIX = 'export-state/'
+
+# Number of rules whose evaluations are fetched concurrently. The calls to Config are paced by an AIMD rate limiter:
+# the rate (calls per second) increases additively on success and is halved on throttling.
+MAX_CONCURRENT_RULES = int(os.environ.get('MaxConcurrentRules', '4'))
+CONFIG_API_INITIAL_RATE = 4.0
+CONFIG_API_MIN_RATE = 0.5
+CONFIG_API_MAX_RATE = 20.0
+CONFIG_API_MAX_RETRIES = 8
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded']
+
 # Define the default resource to report to Config Rules
 DEFAULT_RESOURCE_TYPE = 'AWS::::Account'
 
@@ -158,48 +184,217 @@ def evaluate_compliance(event, context, configuration_item, valid_rule_parameter
     except:
         kinesis_client = get_client_from_role('firehose', role_arn_codepipeline)
     
-    for rule in template_rules_detail:
-        rule_evaluations = get_all_compliance_evaluations(rule["ConfigRuleName"])
-        time.sleep(1) # To avoid throttling
-        for result_id in rule_evaluations:
-            # Record in Kinesis Firehose
-            json_result = {
-                "ConfigRuleArn": rule['ConfigRuleArn'],
-                "EngineRecordedTime": str(datetime.datetime.now()).split(".")[0].split("+")[0],
-                "ConfigRuleName": rule["ConfigRuleName"],
-                "ResourceType": result_id['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceType'],
-                "ResourceId": result_id['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceId'],
-                "ComplianceType": result_id['ComplianceType'],
-                "ResultRecordedTime": str(result_id['ResultRecordedTime']).split(".")[0].split("+")[0],
-                "ConfigRuleInvokedTime": str(result_id['ConfigRuleInvokedTime']).split(".")[0].split("+")[0],
-                "AccountId": invoking_account_id,
-                "AwsRegion": rule['ConfigRuleArn'].split(":")[3]
-            }
-            if 'Annotation' in result_id:
-                json_result["Annotation"] = result_id['Annotation']
-            else:
-                json_result["Annotation"] = "None"
-            kinesis_client.put_record(
-                DeliveryStreamName=FIREHOSE_NAME,
-                Record={
-                    'Data': json.dumps(json_result)
-                }
-            )
+    export_state = {}
+    new_export_state = {'Rules': {}}
+    full_export = True
+    if EXPORT_MODE == 'INCREMENTAL':
+        s3_compliance = get_client_from_role('s3', role_arn_codepipeline)
+        export_state = get_export_state(s3_compliance, TEMPLATE_BUCKET, invoking_account_id)
+        full_export = is_full_export_due(export_state)
+
+    new_export_state['LastFullExport'] = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S') if full_export else export_state['LastFullExport']
+
+    rate_limiter = AdaptiveRateLimiter(CONFIG_API_INITIAL_RATE, CONFIG_API_MIN_RATE, CONFIG_API_MAX_RATE)
+    with FirehoseBatchWriter(kinesis_client, FIREHOSE_NAME) as firehose_writer:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RULES) as executor:
+            rule_exports = {}
+            for rule in template_rules_detail:
+                last_export_digests = {}
+                if not full_export:
+                    last_export_digests = export_state['Rules'].get(rule["ConfigRuleName"], {})
+                rule_exports[rule["ConfigRuleName"]] = executor.submit(export_rule_evaluations, firehose_writer, rule, invoking_account_id, last_export_digests, rate_limiter)
+            for rule_name, rule_export in rule_exports.items():
+                new_export_state['Rules'][rule_name] = rule_export.result()
+
+    # If some records were not delivered, the state is kept so that they are exported again at the next run.
+    if EXPORT_MODE == 'INCREMENTAL' and not firehose_writer.failed_record_count:
+        put_export_state(s3_compliance, TEMPLATE_BUCKET, invoking_account_id, new_export_state)
 
     return "COMPLIANT"
 
-def get_all_compliance_evaluations(rule_name):
-    all_eval_part = AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule(ConfigRuleName=rule_name, Limit=100)
-    all_eval = []
+def get_export_state(s3_client, bucket, account_id):
+    try:
+        state_object = s3_client.get_object(Bucket=bucket, Key=EXPORT_STATE_PREFIX + account_id + '.json')
+        return json.loads(state_object['Body'].read().decode('utf-8'))
+    except Exception as e:
+        # No previous export known (or unreadable): a full export is done.
+        print("No export state for " + account_id + ": " + str(e))
+        return {}
+
+def put_export_state(s3_client, bucket, account_id, export_state):
+    s3_client.put_object(Bucket=bucket, Key=EXPORT_STATE_PREFIX + account_id + '.json', Body=json.dumps(export_state))
+
+def is_full_export_due(export_state):
+    if 'LastFullExport' not in export_state or 'Rules' not in export_state:
+        return True
+    last_full_export = datetime.datetime.strptime(export_state['LastFullExport'], '%Y-%m-%dT%H:%M:%S')
+    return datetime.datetime.utcnow() - last_full_export >= datetime.timedelta(days=FULL_EXPORT_INTERVAL_DAYS)
+
+def get_evaluation_digest(result_id):
+    evaluation_state = result_id['ComplianceType'] + '|' + result_id.get('Annotation', '')
+    return hashlib.md5(evaluation_state.encode('utf-8')).hexdigest()[:12]
+
+def export_rule_evaluations(firehose_writer, rule, invoking_account_id, last_export_digests, rate_limiter=None):
+    """Record the evaluations of the rule in Kinesis Firehose, skipping those unchanged since the last export.
+
+    Return the digest of each evaluation, keyed by resource type and id.
+
+    Keyword arguments:
+    firehose_writer -- the FirehoseBatchWriter to record the evaluations
+    rule -- the rule as returned by describe_config_rules()
+    invoking_account_id -- the account id of the rule
+    last_export_digests -- the digests returned by the last export of the rule (empty dict for a full export)
+    rate_limiter -- the AdaptiveRateLimiter shared by the calls to Config (default None, for a dedicated one)
+    """
+    export_digests = {}
+    if not rate_limiter:
+        rate_limiter = AdaptiveRateLimiter(CONFIG_API_INITIAL_RATE, CONFIG_API_MIN_RATE, CONFIG_API_MAX_RATE)
+    # The pages are streamed to Firehose, the evaluations of a rule are never all kept in memory.
+    for result_id in get_compliance_evaluations(rule["ConfigRuleName"], rate_limiter):
+        resource_key = result_id['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceType'] + '|' + result_id['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceId']
+        export_digests[resource_key] = get_evaluation_digest(result_id)
+        if last_export_digests.get(resource_key) == export_digests[resource_key]:
+            continue
+
+        # Record in Kinesis Firehose
+        json_result = {
+            "ConfigRuleArn": rule['ConfigRuleArn'],
+            "EngineRecordedTime": str(datetime.datetime.now()).split(".")[0].split("+")[0],
+            "ConfigRuleName": rule["ConfigRuleName"],
+            "ResourceType": result_id['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceType'],
+            "ResourceId": result_id['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceId'],
+            "ComplianceType": result_id['ComplianceType'],
+            "ResultRecordedTime": str(result_id['ResultRecordedTime']).split(".")[0].split("+")[0],
+            "ConfigRuleInvokedTime": str(result_id['ConfigRuleInvokedTime']).split(".")[0].split("+")[0],
+            "AccountId": invoking_account_id,
+            "AwsRegion": rule['ConfigRuleArn'].split(":")[3]
+        }
+        if 'Annotation' in result_id:
+            json_result["Annotation"] = result_id['Annotation']
+        else:
+            json_result["Annotation"] = "None"
+        firehose_writer.put_record(json.dumps(json_result))
+    return export_digests
+
+class FirehoseBatchWriter():
+    """Buffer records and send them to Kinesis Firehose with put_record_batch(), within the API limits.
+
+    The records which failed are retried with a backoff. The remaining records are sent when the writer is closed.
+
+    Keyword arguments:
+    firehose_client -- the boto client of Kinesis Firehose
+    delivery_stream_name -- the name of the Kinesis Firehose delivery stream
+    """
+    def __init__(self, firehose_client, delivery_stream_name):
+        self.firehose_client = firehose_client
+        self.delivery_stream_name = delivery_stream_name
+        self.records = []
+        self.records_bytes = 0
+        self.failed_record_count = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def put_record(self, data):
+        data_bytes = data.encode('utf-8')
+        records_to_send = []
+        with self.lock:
+            if len(self.records) >= FIREHOSE_BATCH_MAX_RECORDS or self.records_bytes + len(data_bytes) > FIREHOSE_BATCH_MAX_BYTES:
+                records_to_send = self.take_records()
+            self.records.append({'Data': data_bytes})
+            self.records_bytes += len(data_bytes)
+        self.send_records(records_to_send)
+
+    def flush(self):
+        with self.lock:
+            records_to_send = self.take_records()
+        self.send_records(records_to_send)
+
+    def take_records(self):
+        records = self.records
+        self.records = []
+        self.records_bytes = 0
+        return records
+
+    def send_records(self, records):
+        retry = 0
+        while records and retry <= FIREHOSE_BATCH_MAX_RETRIES:
+            if retry:
+                time.sleep(min(0.1 * 2 ** retry, 5))
+            response = self.firehose_client.put_record_batch(DeliveryStreamName=self.delivery_stream_name, Records=records)
+            if not response['FailedPutCount']:
+                return
+            # Only the records with an ErrorCode are sent again.
+            records = [record for record, result in zip(records, response['RequestResponses']) if 'ErrorCode' in result]
+            retry += 1
+
+        if records:
+            with self.lock:
+                self.failed_record_count += len(records)
+            print("Unable to record " + str(len(records)) + " evaluation(s) in Kinesis Firehose.")
+
+def get_compliance_evaluations(rule_name, rate_limiter):
+    next_token = None
     while True:
-        for eva in all_eval_part['EvaluationResults']:
-            all_eval.append(eva)
-        if 'NextToken' in all_eval_part:
-            next_token = all_eval_part['NextToken']
-            all_eval_part = AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule(ConfigRuleName=rule_name, NextToken=next_token, Limit=100)
+        if next_token:
+            eval_part = call_with_rate_limiter(rate_limiter, AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule, ConfigRuleName=rule_name, NextToken=next_token, Limit=100)
         else:
+            eval_part = call_with_rate_limiter(rate_limiter, AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule, ConfigRuleName=rule_name, Limit=100)
+        for eva in eval_part['EvaluationResults']:
+            yield eva
+        if 'NextToken' not in eval_part:
             break
-    return all_eval
+        next_token = eval_part['NextToken']
+
+def call_with_rate_limiter(rate_limiter, api_call, **kwargs):
+    retry = 0
+    while True:
+        rate_limiter.acquire()
+        try:
+            response = api_call(**kwargs)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] not in THROTTLING_ERROR_CODES or retry >= CONFIG_API_MAX_RETRIES:
+                raise
+            rate_limiter.on_throttle()
+            retry += 1
+            continue
+        rate_limiter.on_success()
+        return response
+
+class AdaptiveRateLimiter():
+    """Pace API calls shared by several threads, with an Additive Increase/Multiplicative Decrease of the rate.
+
+    Keyword arguments:
+    rate -- the initial rate, in calls per second
+    min_rate -- the rate never goes below this value
+    max_rate -- the rate never goes above this value
+    """
+    def __init__(self, rate, min_rate, max_rate):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.next_call_time = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            wait_time = self.next_call_time - now
+            self.next_call_time = max(now, self.next_call_time) + 1.0 / self.rate
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
 
 def get_all_rules():
     all_rules_part = AWS_CONFIG_CLIENT.describe_config_rules()
@@ -215,17 +410,7 @@ def get_all_rules():
     return all_rules
 
 def get_client_from_role(service, role_arn, region=None):
-    credentials = get_assume_role_credentials(role_arn)
-    if not region:
-        return boto3.client(service, aws_access_key_id=credentials['AccessKeyId'],
-                        aws_secret_access_key=credentials['SecretAccessKey'],
-                        aws_session_token=credentials['SessionToken']
-                       )
-    return boto3.client(service, aws_access_key_id=credentials['AccessKeyId'],
-                        aws_secret_access_key=credentials['SecretAccessKey'],
-                        aws_session_token=credentials['SessionToken'],
-                        region_name=region
-                       )
+    return rule_runtime.get_role_client(RULE, service, role_arn, region)
 
 def evaluate_parameters(rule_parameters):
     """Evaluate the rule parameters dictionary validity. Raise a ValueError for invalid parameters.
@@ -243,20 +428,12 @@ def evaluate_parameters(rule_parameters):
 # Helper Functions #
 ####################
 
-# Build an error to be displayed in the logs when the parameter is invalid.
-def build_parameters_value_error_response(ex):
-    """Return an error dictionary when the evaluate_parameters() raises a ValueError.
+# The Boilerplate Code of the Rule Development Kit is shared by all the Rules in rule_runtime.py.
+RULE = sys.modules[__name__]
 
-    Keyword arguments:
-    ex -- Exception text
-    """
-    return  build_error_response(internalErrorMessage="Parameter value is invalid",
-                                 internalErrorDetails="An ValueError was raised during the validation of the Parameter value",
-                                 customerErrorCode="InvalidParameterValueException",
-                                 customerErrorMessage=str(ex))
+# Set by the lambda_handler() to the Config client of the invocation.
+AWS_CONFIG_CLIENT = None
 
-# This gets the client after assuming the Config service role
-# either in the same AWS account or cross-account.
 def get_client(service, event):
     """Return the service boto client. It should be used instead of directly calling the client.
 
@@ -264,15 +441,8 @@ def get_client(service, event):
     service -- the service name used for calling the boto.client()
     event -- the event variable given in the lambda handler
     """
-    if not ASSUME_ROLE_MODE:
-        return boto3.client(service)
-    credentials = get_assume_role_credentials(event["executionRoleArn"])
-    return boto3.client(service, aws_access_key_id=credentials['AccessKeyId'],
-                        aws_secret_access_key=credentials['SecretAccessKey'],
-                        aws_session_token=credentials['SessionToken']
-                       )
-
-# This generate an evaluation for config
+    return rule_runtime.get_client(RULE, service, event)
+
 def build_evaluation(resource_id, compliance_type, event, resource_type=DEFAULT_RESOURCE_TYPE, annotation=None):
     """Form an evaluation as a dictionary. Usually suited to report on scheduled rules.
 
@@ -283,14 +453,7 @@ def build_evaluation(resource_id, compliance_type, event, resource_type=DEFAULT_
     resource_type -- the CloudFormation resource type (or AWS::::Account) to report on the rule (default DEFAULT_RESOURCE_TYPE)
     annotation -- an annotation to be added to the evaluation (default None)
     """
-    eval_cc = {}
-    if annotation:
-        eval_cc['Annotation'] = annotation
-    eval_cc['ComplianceResourceType'] = resource_type
-    eval_cc['ComplianceResourceId'] = resource_id
-    eval_cc['ComplianceType'] = compliance_type
-    eval_cc['OrderingTimestamp'] = str(json.loads(event['invokingEvent'])['notificationCreationTime'])
-    return eval_cc
+    return rule_runtime.build_evaluation(resource_id, compliance_type, event, resource_type, annotation)
 
 def build_evaluation_from_config_item(configuration_item, compliance_type, annotation=None):
     """Form an evaluation as a dictionary. Usually suited to report on configuration change rules.
@@ -300,228 +463,9 @@ def build_evaluation_from_config_item(configuration_item, compliance_type, annot
     compliance_type -- either COMPLIANT, NON_COMPLIANT or NOT_APPLICABLE
     annotation -- an annotation to be added to the evaluation (default None)
     """
-    eval_ci = {}
-    if annotation:
-        eval_ci['Annotation'] = annotation
-    eval_ci['ComplianceResourceType'] = configuration_item['resourceType']
-    eval_ci['ComplianceResourceId'] = configuration_item['resourceId']
-    eval_ci['ComplianceType'] = compliance_type
-    eval_ci['OrderingTimestamp'] = configuration_item['configurationItemCaptureTime']
-    return eval_ci
-
-####################
-# Boilerplate Code #
-####################
+    return rule_runtime.build_evaluation_from_config_item(configuration_item, compliance_type, annotation)
 
-# Helper function used to validate input
-def check_defined(reference, reference_name):
-    if not reference:
-        raise Exception('Error: ', reference_name, 'is not defined')
-    return reference
-
-# Check whether the message is OversizedConfigurationItemChangeNotification or not
-def is_oversized_changed_notification(message_type):
-    check_defined(message_type, 'messageType')
-    return message_type == 'OversizedConfigurationItemChangeNotification'
-
-# Check whether the message is a ScheduledNotification or not.
-def is_scheduled_notification(message_type):
-    check_defined(message_type, 'messageType')
-    return message_type == 'ScheduledNotification'
-
-# Get configurationItem using getResourceConfigHistory API
-# in case of OversizedConfigurationItemChangeNotification
-def get_configuration(resource_type, resource_id, configuration_capture_time):
-    result = AWS_CONFIG_CLIENT.get_resource_config_history(
-        resourceType=resource_type,
-        resourceId=resource_id,
-        laterTime=configuration_capture_time,
-        limit=1)
-    configurationItem = result['configurationItems'][0]
-    return convert_api_configuration(configurationItem)
-
-# Convert from the API model to the original invocation model
-def convert_api_configuration(configurationItem):
-    for k, v in configurationItem.items():
-        if isinstance(v, datetime.datetime):
-            configurationItem[k] = str(v)
-    configurationItem['awsAccountId'] = configurationItem['accountId']
-    configurationItem['ARN'] = configurationItem['arn']
-    configurationItem['configurationStateMd5Hash'] = configurationItem['configurationItemMD5Hash']
-    configurationItem['configurationItemVersion'] = configurationItem['version']
-    configurationItem['configuration'] = json.loads(configurationItem['configuration'])
-    if 'relationships' in configurationItem:
-        for i in range(len(configurationItem['relationships'])):
-            configurationItem['relationships'][i]['name'] = configurationItem['relationships'][i]['relationshipName']
-    return configurationItem
-
-# Based on the type of message get the configuration item
-# either from configurationItem in the invoking event
-# or using the getResourceConfigHistiry API in getConfiguration function.
-def get_configuration_item(invokingEvent):
-    check_defined(invokingEvent, 'invokingEvent')
-    if is_oversized_changed_notification(invokingEvent['messageType']):
-        configurationItemSummary = check_defined(invokingEvent['configurationItemSummary'], 'configurationItemSummary')
-        return get_configuration(configurationItemSummary['resourceType'], configurationItemSummary['resourceId'], configurationItemSummary['configurationItemCaptureTime'])
-    elif is_scheduled_notification(invokingEvent['messageType']):
-        return None
-    return check_defined(invokingEvent['configurationItem'], 'configurationItem')
-
-# Check whether the resource has been deleted. If it has, then the evaluation is unnecessary.
-def is_applicable(configurationItem, event):
-    try:
-        check_defined(configurationItem, 'configurationItem')
-        check_defined(event, 'event')
-    except:
-        return True
-    status = configurationItem['configurationItemStatus']
-    eventLeftScope = event['eventLeftScope']
-    if status == 'ResourceDeleted':
-        print("Resource Deleted, setting Compliance Status to NOT_APPLICABLE.")
-    return (status == 'OK' or status == 'ResourceDiscovered') and not eventLeftScope
-
-def get_assume_role_credentials(role_arn):
-    sts_client = boto3.client('sts')
-    try:
-        assume_role_response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName="configLambdaExecution")
-        return assume_role_response['Credentials']
-    except botocore.exceptions.ClientError as ex:
-        # Scrub error message for any internal account info leaks
-        print(str(ex))
-        if 'AccessDenied' in ex.response['Error']['Code']:
-            ex.response['Error']['Message'] = "AWS Config does not have permission to assume the IAM role."
-        else:
-            ex.response['Error']['Message'] = "InternalError"
-            ex.response['Error']['Code'] = "InternalError"
-        raise ex
-
-# This removes older evaluation (usually useful for periodic rule not reporting on AWS::::Account).
-def clean_up_old_evaluations(latest_evaluations, event):
-
-    cleaned_evaluations = []
-
-    old_eval = AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule(
-        ConfigRuleName=event['configRuleName'],
-        ComplianceTypes=['COMPLIANT', 'NON_COMPLIANT'],
-        Limit=100)
-
-    old_eval_list = []
-
-    while True:
-        for old_result in old_eval['EvaluationResults']:
-            old_eval_list.append(old_result)
-        if 'NextToken' in old_eval:
-            next_token = old_eval['NextToken']
-            old_eval = AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule(
-                ConfigRuleName=event['configRuleName'],
-                ComplianceTypes=['COMPLIANT', 'NON_COMPLIANT'],
-                Limit=100,
-                NextToken=next_token)
-        else:
-            break
-
-    for old_eval in old_eval_list:
-        old_resource_id = old_eval['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceId']
-        newer_founded = False
-        for latest_eval in latest_evaluations:
-            if old_resource_id == latest_eval['ComplianceResourceId']:
-                newer_founded = True
-        if not newer_founded:
-            cleaned_evaluations.append(build_evaluation(old_resource_id, "NOT_APPLICABLE", event))
-
-    return cleaned_evaluations + latest_evaluations
-
-# This decorates the lambda_handler in rule_code with the actual PutEvaluation call
 def lambda_handler(event, context):
-
-    global AWS_CONFIG_CLIENT
-
-    #print(event)
-    check_defined(event, 'event')
-    invoking_event = json.loads(event['invokingEvent'])
-    rule_parameters = {}
-    if 'ruleParameters' in event:
-        rule_parameters = json.loads(event['ruleParameters'])
-
-    try:
-        valid_rule_parameters = evaluate_parameters(rule_parameters)
-    except ValueError as ex:
-        return build_parameters_value_error_response(ex)
-
-    try:
-        AWS_CONFIG_CLIENT = get_client('config', event)
-        if invoking_event['messageType'] in ['ConfigurationItemChangeNotification', 'ScheduledNotification', 'OversizedConfigurationItemChangeNotification']:
-            configuration_item = get_configuration_item(invoking_event)
-            if is_applicable(configuration_item, event):
-                compliance_result = evaluate_compliance(event, context, configuration_item, valid_rule_parameters)
-            else:
-                compliance_result = "NOT_APPLICABLE"
-        else:
-            return build_internal_error_response('Unexpected message type', str(invoking_event))
-    except botocore.exceptions.ClientError as ex:
-        if is_internal_error(ex):
-            return build_internal_error_response("Unexpected error while completing API request", str(ex))
-        return build_error_response("Customer error while making API request", str(ex), ex.response['Error']['Code'], ex.response['Error']['Message'])
-    except ValueError as ex:
-        return build_internal_error_response(str(ex), str(ex))
-
-    evaluations = []
-    latest_evaluations = []
-
-    if not compliance_result:
-        latest_evaluations.append(build_evaluation(event['accountId'], "NOT_APPLICABLE", event, resource_type='AWS::::Account'))
-        evaluations = clean_up_old_evaluations(latest_evaluations, event)
-    elif isinstance(compliance_result, str):
-        if DEFAULT_RESOURCE_TYPE == 'AWS::::Account':
-            evaluations.append(build_evaluation(event['accountId'], compliance_result, event))
-        else:
-            evaluations.append(build_evaluation_from_config_item(configuration_item, compliance_result))
-    elif isinstance(compliance_result, list):
-        for evaluation in compliance_result:
-            missing_fields = False
-            for field in ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp'):
-                if field not in evaluation:
-                    print("Missing " + field + " from custom evaluation.")
-                    missing_fields = True
-
-            if not missing_fields:
-                latest_evaluations.append(evaluation)
-        evaluations = clean_up_old_evaluations(latest_evaluations, event)
-    elif isinstance(compliance_result, dict):
-        missing_fields = False
-        for field in ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp'):
-            if field not in compliance_result:
-                print("Missing " + field + " from custom evaluation.")
-                missing_fields = True
-        if not missing_fields:
-            evaluations.append(compliance_result)
-    else:
-        evaluations.append(build_evaluation_from_config_item(configuration_item, 'NOT_APPLICABLE'))
-
-    # Put together the request that reports the evaluation status
-    resultToken = event['resultToken']
-    testMode = False
-    if resultToken == 'TESTMODE':
-        # Used solely for RDK test to skip actual put_evaluation API call
-        testMode = True
-    # Invoke the Config API to report the result of the evaluation
-    AWS_CONFIG_CLIENT.put_evaluations(Evaluations=evaluations, ResultToken=resultToken, TestMode=testMode)
-    # Used solely for RDK test to be able to test Lambda function
-    return evaluations
-
-def is_internal_error(exception):
-    return ((not isinstance(exception, botocore.exceptions.ClientError)) or exception.response['Error']['Code'].startswith('5')
-            or 'InternalError' in exception.response['Error']['Code'] or 'ServiceError' in exception.response['Error']['Code'])
-
-def build_internal_error_response(internalErrorMessage, internalErrorDetails=None):
-    return build_error_response(internalErrorMessage, internalErrorDetails, 'InternalError', 'InternalError')
-
-def build_error_response(internalErrorMessage, internalErrorDetails=None, customerErrorCode=None, customerErrorMessage=None):
-    error_response = {
-        'internalErrorMessage': internalErrorMessage,
-        'internalErrorDetails': internalErrorDetails,
-        'customerErrorMessage': customerErrorMessage,
-        'customerErrorCode': customerErrorCode
-    }
-    print(error_response)
-    return error_response
+    return rule_runtime.lambda_handler(RULE, event, context,
+                                       lambda event, configuration_item, valid_rule_parameters: evaluate_compliance(event, context, configuration_item, valid_rule_parameters),
+                                       rule_runtime.STRING_RESULT_ACCOUNT)
@@ -1,4 +1,6 @@
 import sys
+import json
+import datetime
 import unittest
 try:
     from unittest.mock import MagicMock, patch, ANY
@@ -54,10 +56,142 @@ class SampleTest(unittest.TestCase):
         resp_expected.append(build_expected_response('NOT_APPLICABLE', 'some-resource-id', 'AWS::IAM::Role'))
         assert_successful_evaluation(self, response, resp_expected)
 
+class FirehoseBatchWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.firehose_client_mock = MagicMock()
+        self.firehose_client_mock.put_record_batch = MagicMock(return_value={'FailedPutCount': 0, 'RequestResponses': []})
+
+    def test_batch_max_records(self):
+        with rule.FirehoseBatchWriter(self.firehose_client_mock, 'stream') as writer:
+            for i in range(1001):
+                writer.put_record('{"ResourceId": "' + str(i) + '"}')
+        batch_sizes = [len(call[1]['Records']) for call in self.firehose_client_mock.put_record_batch.call_args_list]
+        self.assertEqual([500, 500, 1], batch_sizes)
+
+    def test_batch_max_bytes(self):
+        data = 'a' * (1024 * 1024)
+        with rule.FirehoseBatchWriter(self.firehose_client_mock, 'stream') as writer:
+            for _ in range(5):
+                writer.put_record(data)
+        batch_sizes = [len(call[1]['Records']) for call in self.firehose_client_mock.put_record_batch.call_args_list]
+        self.assertEqual([4, 1], batch_sizes)
+
+    def test_no_record_no_call(self):
+        with rule.FirehoseBatchWriter(self.firehose_client_mock, 'stream'):
+            pass
+        self.firehose_client_mock.put_record_batch.assert_not_called()
+
+    @patch.object(rule.time, 'sleep')
+    def test_retry_failed_records_only(self, sleep_mock):
+        self.firehose_client_mock.put_record_batch = MagicMock(side_effect=[
+            {'FailedPutCount': 1, 'RequestResponses': [{'RecordId': 'id1'}, {'ErrorCode': 'ServiceUnavailableException'}, {'RecordId': 'id3'}]},
+            {'FailedPutCount': 0, 'RequestResponses': [{'RecordId': 'id2'}]}])
+        with rule.FirehoseBatchWriter(self.firehose_client_mock, 'stream') as writer:
+            for data in ['1', '2', '3']:
+                writer.put_record(data)
+        self.assertEqual(2, self.firehose_client_mock.put_record_batch.call_count)
+        self.assertEqual([{'Data': b'2'}], self.firehose_client_mock.put_record_batch.call_args_list[1][1]['Records'])
+        self.assertEqual(0, writer.failed_record_count)
+
+    @patch.object(rule.time, 'sleep')
+    def test_retry_exhausted(self, sleep_mock):
+        self.firehose_client_mock.put_record_batch = MagicMock(return_value={'FailedPutCount': 1, 'RequestResponses': [{'ErrorCode': 'ServiceUnavailableException'}]})
+        with rule.FirehoseBatchWriter(self.firehose_client_mock, 'stream') as writer:
+            writer.put_record('1')
+        self.assertEqual(rule.FIREHOSE_BATCH_MAX_RETRIES + 1, self.firehose_client_mock.put_record_batch.call_count)
+        self.assertEqual(1, writer.failed_record_count)
+
+class IncrementalExportTest(unittest.TestCase):
+
+    rule_detail = {
+        'ConfigRuleName': 'some-rule',
+        'ConfigRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan'
+        }
+
+    def setUp(self):
+        rule.AWS_CONFIG_CLIENT = config_client_mock
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(return_value={'EvaluationResults': [
+            build_evaluation_result('vol-1', 'COMPLIANT'),
+            build_evaluation_result('vol-2', 'NON_COMPLIANT', 'Not encrypted.')]})
+        self.writer_mock = MagicMock()
+
+    @patch.object(rule.time, 'sleep')
+    def test_full_export(self, sleep_mock):
+        digests = rule.export_rule_evaluations(self.writer_mock, self.rule_detail, '123456789012', {})
+        self.assertEqual(2, self.writer_mock.put_record.call_count)
+        self.assertEqual(['AWS::EC2::Volume|vol-1', 'AWS::EC2::Volume|vol-2'], sorted(digests.keys()))
+
+    @patch.object(rule.time, 'sleep')
+    def test_incremental_export_changed_only(self, sleep_mock):
+        last_digests = rule.export_rule_evaluations(MagicMock(), self.rule_detail, '123456789012', {})
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(return_value={'EvaluationResults': [
+            build_evaluation_result('vol-1', 'COMPLIANT'),
+            build_evaluation_result('vol-2', 'COMPLIANT'),
+            build_evaluation_result('vol-3', 'COMPLIANT')]})
+        rule.export_rule_evaluations(self.writer_mock, self.rule_detail, '123456789012', last_digests)
+        exported = [json.loads(call[0][0])['ResourceId'] for call in self.writer_mock.put_record.call_args_list]
+        self.assertEqual(['vol-2', 'vol-3'], exported)
+
+    def test_full_export_due(self):
+        self.assertTrue(rule.is_full_export_due({}))
+        last_week = (datetime.datetime.utcnow() - datetime.timedelta(days=rule.FULL_EXPORT_INTERVAL_DAYS)).strftime('%Y-%m-%dT%H:%M:%S')
+        self.assertTrue(rule.is_full_export_due({'LastFullExport': last_week, 'Rules': {}}))
+        yesterday = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        self.assertFalse(rule.is_full_export_due({'LastFullExport': yesterday, 'Rules': {}}))
+
 ####################
 # Helper Functions #
 ####################
 
+class AdaptiveRateLimiterTest(unittest.TestCase):
+
+    def test_rate_halved_on_throttle(self):
+        rate_limiter = rule.AdaptiveRateLimiter(4.0, 1.0, 10.0)
+        rate_limiter.on_throttle()
+        self.assertEqual(rate_limiter.rate, 2.0)
+        rate_limiter.on_throttle()
+        rate_limiter.on_throttle()
+        self.assertEqual(rate_limiter.rate, 1.0)
+
+    def test_rate_increased_on_success(self):
+        rate_limiter = rule.AdaptiveRateLimiter(9.95, 1.0, 10.0)
+        rate_limiter.on_success()
+        self.assertEqual(rate_limiter.rate, 10.0)
+
+    @patch.object(rule.time, 'sleep')
+    def test_throttled_call_retried(self, sleep_mock):
+        rate_limiter = rule.AdaptiveRateLimiter(4.0, 1.0, 10.0)
+        throttling_error = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'operation')
+        api_call = MagicMock(side_effect=[throttling_error, {'EvaluationResults': []}])
+        self.assertEqual(rule.call_with_rate_limiter(rate_limiter, api_call, ConfigRuleName='some-rule'), {'EvaluationResults': []})
+        self.assertEqual(api_call.call_count, 2)
+        self.assertEqual(rate_limiter.rate, 2.1)
+
+    @patch.object(rule.time, 'sleep')
+    def test_other_error_not_retried(self, sleep_mock):
+        rate_limiter = rule.AdaptiveRateLimiter(4.0, 1.0, 10.0)
+        api_call = MagicMock(side_effect=ClientError({'Error': {'Code': 'NoSuchConfigRuleException', 'Message': 'No rule'}}, 'operation'))
+        with self.assertRaises(ClientError):
+            rule.call_with_rate_limiter(rate_limiter, api_call, ConfigRuleName='some-rule')
+        self.assertEqual(api_call.call_count, 1)
+
+def build_evaluation_result(resource_id, compliance_type, annotation=None):
+    evaluation_result = {
+        'EvaluationResultIdentifier': {
+            'EvaluationResultQualifier': {
+                'ResourceType': 'AWS::EC2::Volume',
+                'ResourceId': resource_id
+                }
+            },
+        'ComplianceType': compliance_type,
+        'ResultRecordedTime': datetime.datetime(2018, 7, 2, 3, 37, 52),
+        'ConfigRuleInvokedTime': datetime.datetime(2018, 7, 2, 3, 37, 50)
+        }
+    if annotation:
+        evaluation_result['Annotation'] = annotation
+    return evaluation_result
+
 def build_lambda_configurationchange_event(invoking_event, rule_parameters=None):
     event_to_return = {
         'configRuleName':'myrule',
@@ -0,0 +1,480 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+# Created with the Rule Development Kit: https://github.com/awslabs/aws-config-rdk
+# Can be used stand-alone or with the Rule Compliance Engine: https://github.com/awslabs/aws-config-engine-for-compliance-as-code
+#
+'''
+Runtime shared by the custom Config Rules of the engine.
+
+It replaces the Boilerplate Code of the Rule Development Kit. Each Rule using it has a copy of this file in its folder,
+kept identical by rule_runtime_test.py. A Rule keeps its Parameters (DEFAULT_RESOURCE_TYPE, ASSUME_ROLE_MODE), its evaluate_compliance()
+and its evaluate_parameters(), and gives its own module to the functions needing them:
+
+    def lambda_handler(event, context):
+        return rule_runtime.lambda_handler(RULE, event, context)
+
+The boto3 module imported by the Rule is used to create the clients.
+'''
+import os
+import json
+import datetime
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import botocore
+
+# The assumed credentials are reused by the next invocations of a warm container until this margin before their
+# expiration. It covers the maximum duration of a Lambda invocation.
+CREDENTIALS_EXPIRATION_MARGIN = datetime.timedelta(minutes=15)
+
+# Cache of the assumed credentials, keyed by role ARN.
+CREDENTIALS_CACHE = {}
+
+# Cache of the clients, keyed by (role ARN, service, region). The role ARN is None for the clients of the Lambda role.
+CLIENT_CACHE = {}
+
+# Cache of the output of evaluate_parameters(), keyed by (Rule name, raw ruleParameters string of the event).
+PARAMETERS_CACHE = {}
+
+CACHE_LOCK = threading.Lock()
+
+# Maximum number of evaluations accepted by a single put_evaluations() call.
+PUT_EVALUATIONS_CHUNK_SIZE = 100
+
+# Number of put_evaluations() calls sent in parallel (Lambda environment variable MaxConcurrentPutEvaluations).
+PUT_EVALUATIONS_MAX_CONCURRENCY = int(os.environ.get('MaxConcurrentPutEvaluations', 4))
+
+# Retries of a throttled put_evaluations() call, with an exponential backoff starting at PUT_EVALUATIONS_BASE_DELAY seconds.
+PUT_EVALUATIONS_MAX_RETRIES = 5
+PUT_EVALUATIONS_BASE_DELAY = 0.5
+
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded']
+
+# How a string returned by evaluate_compliance() is reported: on the configuration item, or on the account when there
+# is none (default),
+STRING_RESULT_CONFIG_ITEM_OR_ACCOUNT = 'CONFIG_ITEM_OR_ACCOUNT'
+# always on the configuration item,
+STRING_RESULT_CONFIG_ITEM = 'CONFIG_ITEM'
+# always on the account.
+STRING_RESULT_ACCOUNT = 'ACCOUNT'
+
+####################
+# Helper Functions #
+####################
+
+# Build an error to be displayed in the logs when the parameter is invalid.
+def build_parameters_value_error_response(ex):
+    """Return an error dictionary when the evaluate_parameters() raises a ValueError.
+
+    Keyword arguments:
+    ex -- Exception text
+    """
+    return  build_error_response(internalErrorMessage="Parameter value is invalid",
+                                 internalErrorDetails="An ValueError was raised during the validation of the Parameter value",
+                                 customerErrorCode="InvalidParameterValueException",
+                                 customerErrorMessage=str(ex))
+
+# This gets the client after assuming the Config service role
+# either in the same AWS account or cross-account.
+def get_client(rule, service, event, region=None):
+    """Return the service boto client. It should be used instead of directly calling the client.
+
+    Keyword arguments:
+    rule -- the module of the Rule
+    service -- the service name used for calling the boto.client()
+    event -- the event variable given in the lambda handler
+    region -- the region of the client (default the region of the Lambda)
+    """
+    if not rule.ASSUME_ROLE_MODE:
+        return get_cached_client(rule, service, None, None, region)
+    return get_role_client(rule, service, event["executionRoleArn"], region)
+
+def get_role_client(rule, service, role_arn, region=None):
+    """Return the service boto client using the credentials of the given role, reusing the cached ones when valid.
+
+    Keyword arguments:
+    rule -- the module of the Rule
+    service -- the service name used for calling the boto.client()
+    role_arn -- the ARN of the role to assume
+    region -- the region of the client (default the region of the Lambda)
+    """
+    credentials = get_assume_role_credentials(rule, role_arn)
+    return get_cached_client(rule, service, role_arn, credentials, region)
+
+def get_cached_client(rule, service, role_arn, credentials, region):
+    cache_key = (role_arn, service, region or os.environ.get('AWS_REGION'))
+    with CACHE_LOCK:
+        cached_client = CLIENT_CACHE.get(cache_key)
+    # A cached client is only valid if it was built by the same boto3 with the same credentials.
+    if cached_client and cached_client['boto3'] is rule.boto3 and cached_client['credentials'] is credentials:
+        return cached_client['client']
+
+    client_kwargs = {}
+    if credentials:
+        client_kwargs['aws_access_key_id'] = credentials['AccessKeyId']
+        client_kwargs['aws_secret_access_key'] = credentials['SecretAccessKey']
+        client_kwargs['aws_session_token'] = credentials['SessionToken']
+    if region:
+        client_kwargs['region_name'] = region
+    client = rule.boto3.client(service, **client_kwargs)
+    with CACHE_LOCK:
+        remove_expiring_entries()
+        # The clients built from credentials which are not cached would never be reused.
+        if not credentials or CREDENTIALS_CACHE.get(role_arn) is credentials:
+            CLIENT_CACHE[cache_key] = {'boto3': rule.boto3, 'credentials': credentials, 'client': client}
+    return client
+
+# This generate an evaluation for config
+def build_evaluation(resource_id, compliance_type, event, resource_type, annotation=None):
+    """Form an evaluation as a dictionary. Usually suited to report on scheduled rules.
+
+    Keyword arguments:
+    resource_id -- the unique id of the resource to report
+    compliance_type -- either COMPLIANT, NON_COMPLIANT or NOT_APPLICABLE
+    event -- the event variable given in the lambda handler
+    resource_type -- the CloudFormation resource type (or AWS::::Account) to report on the rule
+    annotation -- an annotation to be added to the evaluation (default None)
+    """
+    eval_cc = {}
+    if annotation:
+        eval_cc['Annotation'] = annotation
+    eval_cc['ComplianceResourceType'] = resource_type
+    eval_cc['ComplianceResourceId'] = resource_id
+    eval_cc['ComplianceType'] = compliance_type
+    eval_cc['OrderingTimestamp'] = str(json.loads(event['invokingEvent'])['notificationCreationTime'])
+    return eval_cc
+
+def build_evaluation_from_config_item(configuration_item, compliance_type, annotation=None):
+    """Form an evaluation as a dictionary. Usually suited to report on configuration change rules.
+
+    Keyword arguments:
+    configuration_item -- the configurationItem dictionary in the invokingEvent
+    compliance_type -- either COMPLIANT, NON_COMPLIANT or NOT_APPLICABLE
+    annotation -- an annotation to be added to the evaluation (default None)
+    """
+    eval_ci = {}
+    if annotation:
+        eval_ci['Annotation'] = annotation
+    eval_ci['ComplianceResourceType'] = configuration_item['resourceType']
+    eval_ci['ComplianceResourceId'] = configuration_item['resourceId']
+    eval_ci['ComplianceType'] = compliance_type
+    eval_ci['OrderingTimestamp'] = configuration_item['configurationItemCaptureTime']
+    return eval_ci
+
+# Measure the duration of a step of the invocation, in milliseconds.
+@contextmanager
+def timed_step(timings, step_name):
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        timings[step_name] = timings.get(step_name, 0) + int((time.time() - start_time) * 1000)
+
+####################
+# Boilerplate Code #
+####################
+
+# Helper function used to validate input
+def check_defined(reference, reference_name):
+    if not reference:
+        raise Exception('Error: ', reference_name, 'is not defined')
+    return reference
+
+# Check whether the message is OversizedConfigurationItemChangeNotification or not
+def is_oversized_changed_notification(message_type):
+    check_defined(message_type, 'messageType')
+    return message_type == 'OversizedConfigurationItemChangeNotification'
+
+# Check whether the message is a ScheduledNotification or not.
+def is_scheduled_notification(message_type):
+    check_defined(message_type, 'messageType')
+    return message_type == 'ScheduledNotification'
+
+# Get configurationItem using getResourceConfigHistory API
+# in case of OversizedConfigurationItemChangeNotification
+def get_configuration(config_client, resource_type, resource_id, configuration_capture_time):
+    result = config_client.get_resource_config_history(
+        resourceType=resource_type,
+        resourceId=resource_id,
+        laterTime=configuration_capture_time,
+        limit=1)
+    configurationItem = result['configurationItems'][0]
+    return convert_api_configuration(configurationItem)
+
+# Convert from the API model to the original invocation model
+def convert_api_configuration(configurationItem):
+    for k, v in configurationItem.items():
+        if isinstance(v, datetime.datetime):
+            configurationItem[k] = str(v)
+    configurationItem['awsAccountId'] = configurationItem['accountId']
+    configurationItem['ARN'] = configurationItem['arn']
+    configurationItem['configurationStateMd5Hash'] = configurationItem['configurationItemMD5Hash']
+    configurationItem['configurationItemVersion'] = configurationItem['version']
+    configurationItem['configuration'] = json.loads(configurationItem['configuration'])
+    if 'relationships' in configurationItem:
+        for i in range(len(configurationItem['relationships'])):
+            configurationItem['relationships'][i]['name'] = configurationItem['relationships'][i]['relationshipName']
+    return configurationItem
+
+# Based on the type of message get the configuration item
+# either from configurationItem in the invoking event
+# or using the getResourceConfigHistiry API in getConfiguration function.
+def get_configuration_item(config_client, invokingEvent):
+    check_defined(invokingEvent, 'invokingEvent')
+    if is_oversized_changed_notification(invokingEvent['messageType']):
+        configurationItemSummary = check_defined(invokingEvent['configurationItemSummary'], 'configurationItemSummary')
+        return get_configuration(config_client, configurationItemSummary['resourceType'], configurationItemSummary['resourceId'], configurationItemSummary['configurationItemCaptureTime'])
+    elif is_scheduled_notification(invokingEvent['messageType']):
+        return None
+    return check_defined(invokingEvent['configurationItem'], 'configurationItem')
+
+# Check whether the resource has been deleted. If it has, then the evaluation is unnecessary.
+def is_applicable(configurationItem, event):
+    try:
+        check_defined(configurationItem, 'configurationItem')
+        check_defined(event, 'event')
+    except:
+        return True
+    status = configurationItem['configurationItemStatus']
+    eventLeftScope = event['eventLeftScope']
+    if status == 'ResourceDeleted':
+        print("Resource Deleted, setting Compliance Status to NOT_APPLICABLE.")
+    return (status == 'OK' or status == 'ResourceDiscovered') and not eventLeftScope
+
+def get_assume_role_credentials(rule, role_arn):
+    with CACHE_LOCK:
+        cached_credentials = CREDENTIALS_CACHE.get(role_arn)
+    if cached_credentials and not is_expiring(cached_credentials):
+        return cached_credentials
+
+    sts_client = rule.boto3.client('sts')
+    try:
+        assume_role_response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName="configLambdaExecution")
+    except botocore.exceptions.ClientError as ex:
+        # Scrub error message for any internal account info leaks
+        # print(str(ex))
+        if 'AccessDenied' in ex.response['Error']['Code']:
+            ex.response['Error']['Message'] = "AWS Config does not have permission to assume the IAM role."
+        else:
+            ex.response['Error']['Message'] = "InternalError"
+            ex.response['Error']['Code'] = "InternalError"
+        raise ex
+    credentials = assume_role_response['Credentials']
+    if isinstance(credentials.get('Expiration'), datetime.datetime):
+        with CACHE_LOCK:
+            remove_expiring_entries()
+            CREDENTIALS_CACHE[role_arn] = credentials
+    return credentials
+
+# Check whether the credentials expire within the CREDENTIALS_EXPIRATION_MARGIN
+def is_expiring(credentials):
+    expiration = credentials['Expiration']
+    return datetime.datetime.now(expiration.tzinfo) + CREDENTIALS_EXPIRATION_MARGIN >= expiration
+
+# Remove the expiring credentials and the clients built from credentials no longer cached, so that the caches do not
+# grow with every role assumed by a warm container. It must be called with the CACHE_LOCK held.
+def remove_expiring_entries():
+    for role_arn in [role_arn for role_arn, credentials in CREDENTIALS_CACHE.items() if is_expiring(credentials)]:
+        del CREDENTIALS_CACHE[role_arn]
+    for cache_key in [cache_key for cache_key, cached_client in CLIENT_CACHE.items()
+                      if cached_client['credentials'] and CREDENTIALS_CACHE.get(cache_key[0]) is not cached_client['credentials']]:
+        del CLIENT_CACHE[cache_key]
+
+# This removes older evaluation (usually useful for periodic rule not reporting on AWS::::Account).
+def clean_up_old_evaluations(rule, config_client, latest_evaluations, event):
+
+    latest_resource_ids = set(evaluation['ComplianceResourceId'] for evaluation in latest_evaluations)
+
+    cleaned_evaluations = []
+    for old_eval in get_old_evaluations(config_client, event):
+        old_resource_id = old_eval['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceId']
+        if old_resource_id not in latest_resource_ids:
+            cleaned_evaluations.append(build_evaluation(old_resource_id, "NOT_APPLICABLE", event, rule.DEFAULT_RESOURCE_TYPE))
+
+    return cleaned_evaluations + latest_evaluations
+
+# Yield the previous COMPLIANT and NON_COMPLIANT evaluations of the rule, one page at a time.
+def get_old_evaluations(config_client, event):
+    request = {
+        'ConfigRuleName': event['configRuleName'],
+        'ComplianceTypes': ['COMPLIANT', 'NON_COMPLIANT'],
+        'Limit': 100}
+    while True:
+        old_eval = config_client.get_compliance_details_by_config_rule(**request)
+        for old_result in old_eval['EvaluationResults']:
+            yield old_result
+        if 'NextToken' not in old_eval:
+            break
+        request['NextToken'] = old_eval['NextToken']
+
+# Check that a custom evaluation has all the fields required by put_evaluations()
+def is_complete_evaluation(evaluation):
+    missing_fields = False
+    for field in ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp'):
+        if field not in evaluation:
+            print("Missing " + field + " from custom evaluation.")
+            missing_fields = True
+    return not missing_fields
+
+# Form the evaluations to be reported from the result of evaluate_compliance()
+def build_evaluations(rule, config_client, event, configuration_item, compliance_result, string_result):
+    evaluations = []
+    latest_evaluations = []
+
+    if not compliance_result:
+        latest_evaluations.append(build_evaluation(event['accountId'], "NOT_APPLICABLE", event, 'AWS::::Account'))
+        evaluations = clean_up_old_evaluations(rule, config_client, latest_evaluations, event)
+    elif isinstance(compliance_result, str):
+        if string_result == STRING_RESULT_ACCOUNT or (string_result == STRING_RESULT_CONFIG_ITEM_OR_ACCOUNT and not configuration_item):
+            evaluations.append(build_evaluation(event['accountId'], compliance_result, event, rule.DEFAULT_RESOURCE_TYPE))
+        else:
+            evaluations.append(build_evaluation_from_config_item(configuration_item, compliance_result))
+    elif isinstance(compliance_result, list):
+        latest_evaluations = [evaluation for evaluation in compliance_result if is_complete_evaluation(evaluation)]
+        evaluations = clean_up_old_evaluations(rule, config_client, latest_evaluations, event)
+    elif isinstance(compliance_result, dict):
+        if is_complete_evaluation(compliance_result):
+            evaluations.append(compliance_result)
+    else:
+        evaluations.append(build_evaluation_from_config_item(configuration_item, 'NOT_APPLICABLE'))
+
+    return evaluations
+
+# This decorates the lambda_handler in rule_code with the actual PutEvaluation call
+def lambda_handler(rule, event, context, evaluate_compliance=None, string_result=STRING_RESULT_CONFIG_ITEM_OR_ACCOUNT):
+    """Evaluate the compliance of the Rule and report the evaluations to Config.
+
+    Keyword arguments:
+    rule -- the module of the Rule
+    event -- the event variable given in the lambda handler
+    context -- the context variable given in the lambda handler
+    evaluate_compliance -- the function called as evaluate_compliance(event, configuration_item, valid_rule_parameters) (default rule.evaluate_compliance)
+    string_result -- how a string result is reported, one of the STRING_RESULT_* (default STRING_RESULT_CONFIG_ITEM_OR_ACCOUNT)
+    """
+    if not evaluate_compliance:
+        evaluate_compliance = rule.evaluate_compliance
+
+    # The duration of each step is printed at the end of the invocation.
+    timings = {}
+    try:
+        return evaluate_and_report(rule, event, evaluate_compliance, string_result, timings)
+    finally:
+        print("Invocation timings (ms): " + json.dumps(timings, sort_keys=True))
+
+def evaluate_and_report(rule, event, evaluate_compliance, string_result, timings):
+
+    #print(event)
+    check_defined(event, 'event')
+    invoking_event = json.loads(event['invokingEvent'])
+
+    # The parameters are only parsed and validated once per warm container. An invalid value is not cached.
+    parameters_cache_key = (rule.__name__, event.get('ruleParameters'))
+    with CACHE_LOCK:
+        cached_parameters = PARAMETERS_CACHE.get(parameters_cache_key)
+    if cached_parameters:
+        valid_rule_parameters = cached_parameters['valid_rule_parameters']
+    else:
+        rule_parameters = {}
+        if 'ruleParameters' in event:
+            rule_parameters = json.loads(event['ruleParameters'])
+
+        try:
+            with timed_step(timings, 'evaluate_parameters'):
+                valid_rule_parameters = rule.evaluate_parameters(rule_parameters)
+        except ValueError as ex:
+            return build_parameters_value_error_response(ex)
+        with CACHE_LOCK:
+            PARAMETERS_CACHE[parameters_cache_key] = {'valid_rule_parameters': valid_rule_parameters}
+
+    try:
+        with timed_step(timings, 'get_client'):
+            config_client = get_client(rule, 'config', event)
+        # The Rules may call Config directly through their AWS_CONFIG_CLIENT.
+        rule.AWS_CONFIG_CLIENT = config_client
+        if invoking_event['messageType'] in ['ConfigurationItemChangeNotification', 'ScheduledNotification', 'OversizedConfigurationItemChangeNotification']:
+            with timed_step(timings, 'get_configuration_item'):
+                configuration_item = get_configuration_item(config_client, invoking_event)
+            if is_applicable(configuration_item, event):
+                with timed_step(timings, 'evaluate_compliance'):
+                    compliance_result = evaluate_compliance(event, configuration_item, valid_rule_parameters)
+            else:
+                compliance_result = "NOT_APPLICABLE"
+        else:
+            return build_internal_error_response('Unexpected message type', str(invoking_event))
+    except botocore.exceptions.ClientError as ex:
+        if is_internal_error(ex):
+            return build_internal_error_response("Unexpected error while completing API request", str(ex))
+        return build_error_response("Customer error while making API request", str(ex), ex.response['Error']['Code'], ex.response['Error']['Message'])
+    except ValueError as ex:
+        return build_internal_error_response(str(ex), str(ex))
+
+    with timed_step(timings, 'build_evaluations'):
+        evaluations = build_evaluations(rule, config_client, event, configuration_item, compliance_result, string_result)
+
+    # Put together the request that reports the evaluation status
+    resultToken = event['resultToken']
+    testMode = False
+    if resultToken == 'TESTMODE':
+        # Used solely for RDK test to skip actual put_evaluation API call
+        testMode = True
+    # Invoke the Config API to report the result of the evaluation
+    with timed_step(timings, 'put_evaluations'):
+        failed_evaluations = put_evaluations(config_client, evaluations, resultToken, testMode)
+    if failed_evaluations:
+        print("Config did not accept " + str(len(failed_evaluations)) + " evaluation(s): " + str(failed_evaluations))
+    # Used solely for RDK test to be able to test Lambda function
+    return evaluations
+
+# Report the evaluations to Config, by chunks of PUT_EVALUATIONS_CHUNK_SIZE sent in parallel
+def put_evaluations(config_client, evaluations, result_token, test_mode=False):
+    """Send the evaluations to Config and return the FailedEvaluations of all the calls.
+
+    Keyword arguments:
+    config_client -- the Config boto client
+    evaluations -- the list of evaluation dictionaries
+    result_token -- the resultToken of the event
+    test_mode -- set to True to validate the evaluations without recording them (default False)
+    """
+    chunks = [evaluations[i:i + PUT_EVALUATIONS_CHUNK_SIZE] for i in range(0, len(evaluations), PUT_EVALUATIONS_CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        return put_evaluations_chunk(config_client, evaluations, result_token, test_mode)
+
+    failed_evaluations = []
+    with ThreadPoolExecutor(max_workers=PUT_EVALUATIONS_MAX_CONCURRENCY) as executor:
+        futures = [executor.submit(put_evaluations_chunk, config_client, chunk, result_token, test_mode) for chunk in chunks]
+        for future in futures:
+            failed_evaluations.extend(future.result())
+    return failed_evaluations
+
+def put_evaluations_chunk(config_client, evaluations, result_token, test_mode):
+    retry = 0
+    while True:
+        try:
+            response = config_client.put_evaluations(Evaluations=evaluations, ResultToken=result_token, TestMode=test_mode)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] not in THROTTLING_ERROR_CODES or retry >= PUT_EVALUATIONS_MAX_RETRIES:
+                raise
+            time.sleep(random.uniform(0, PUT_EVALUATIONS_BASE_DELAY * 2 ** retry))
+            retry += 1
+            continue
+        return list(response.get('FailedEvaluations', []))
+
+def is_internal_error(exception):
+    return ((not isinstance(exception, botocore.exceptions.ClientError)) or exception.response['Error']['Code'].startswith('5')
+            or 'InternalError' in exception.response['Error']['Code'] or 'ServiceError' in exception.response['Error']['Code'])
+
+def build_internal_error_response(internalErrorMessage, internalErrorDetails=None):
+    return build_error_response(internalErrorMessage, internalErrorDetails, 'InternalError', 'InternalError')
+
+def build_error_response(internalErrorMessage, internalErrorDetails=None, customerErrorCode=None, customerErrorMessage=None):
+    error_response = {
+        'internalErrorMessage': internalErrorMessage,
+        'internalErrorDetails': internalErrorDetails,
+        'customerErrorMessage': customerErrorMessage,
+        'customerErrorCode': customerErrorCode
+    }
+    print(error_response)
+    return error_response
@@ -11,6 +11,7 @@ Description:
 
 Trigger:
   Configuration Change on AWS::EC2::Volume
+  Periodic (evaluates all the volumes of the region)
 
 Reports on:
   AWS::EC2::Volume
@@ -118,12 +119,20 @@ Scenarios:
         And: the KmsIdList parameter is configured and valid.
         And: the Kms key ID encryting the volume is in KmsIdList.
        Then: return COMPLIANT
+
+    Scenario 14:
+      Given: the rule is triggered by a ScheduledNotification.
+       Then: evaluate all the volumes of the region as in the scenarios 4 to 13.
+        And: return NOT_APPLICABLE for the volumes which no longer exist.
 '''
 
-import json
-import datetime
+import sys
+import os
+import re
+import time
+# The boto3 module of the Rule is used by rule_runtime to create the clients.
 import boto3
-import botocore
+import rule_runtime
 
 ##############
 # Parameters #
@@ -135,27 +144,134 @@ DEFAULT_RESOURCE_TYPE = 'AWS::EC2::Volume'
 # Set to True to get the lambda to assume the Role attached on the Config Service (useful for cross-account).
 ASSUME_ROLE_MODE = True
 
+# Duration in seconds for which the subnet of an instance is reused by the next invocations of a warm container.
+INSTANCE_SUBNET_CACHE_TTL = 3600
+
+# Cache of the subnet ID of the instances, as {(account_id, region, instance_id): (subnet_id, cached_at)}.
+INSTANCE_SUBNET_CACHE = {}
+
+# Valid format of the IDs in the parameters: lower case alphanumerical groups separated by single dashes.
+KMS_ID_PATTERN = re.compile(r'^[a-z0-9]+(-[a-z0-9]+)+$')
+VOLUME_ID_PATTERN = re.compile(r'^vol-[a-z0-9]+$')
+SUBNET_ID_PATTERN = re.compile(r'^subnet-[a-z0-9]+$')
+
 #############
 # Main Code #
 #############
 
 # Compliance Evaluation Helper Functions
-def get_subnet_id(instance_id, event):
-    ec2_client = get_client('ec2', event)
-    all_instances = ec2_client.describe_instances(InstanceIds=[instance_id])
-    for reservation in all_instances['Reservations']:
-        for instance in reservation['Instances']:
-            return instance['SubnetId']
+def get_instance_cache_key(event, instance_id):
+    # The EC2 client is created for the account of the event, in the region of the Lambda function.
+    return (event['accountId'], os.environ.get('AWS_REGION'), instance_id)
+
+def get_subnet_ids(instance_ids, event):
+    now = time.time()
+    subnet_ids = {}
+    missing_instance_ids = []
+    for instance_id in instance_ids:
+        cached_subnet = INSTANCE_SUBNET_CACHE.get(get_instance_cache_key(event, instance_id))
+        if cached_subnet and now - cached_subnet[1] < INSTANCE_SUBNET_CACHE_TTL:
+            subnet_ids[instance_id] = cached_subnet[0]
+        else:
+            missing_instance_ids.append(instance_id)
+
+    # All the instances missing from the cache are described in a single call.
+    if missing_instance_ids:
+        remove_expired_instance_subnets(now)
+        ec2_client = get_client('ec2', event)
+        all_instances = ec2_client.describe_instances(InstanceIds=missing_instance_ids)
+        for reservation in all_instances['Reservations']:
+            for instance in reservation['Instances']:
+                if 'SubnetId' in instance:
+                    subnet_ids[instance['InstanceId']] = instance['SubnetId']
+                    INSTANCE_SUBNET_CACHE[get_instance_cache_key(event, instance['InstanceId'])] = (instance['SubnetId'], now)
+    return subnet_ids
+
+# Remove the expired entries before caching new ones, so that the terminated instances do not stay in the cache.
+def remove_expired_instance_subnets(now):
+    for cache_key in [cache_key for cache_key, cached_subnet in INSTANCE_SUBNET_CACHE.items() if now - cached_subnet[1] >= INSTANCE_SUBNET_CACHE_TTL]:
+        del INSTANCE_SUBNET_CACHE[cache_key]
+
+def get_attached_subnet_ids(configuration_item, event):
+    relationships = configuration_item.get('relationships') or []
+    # The relationships of the configuration item may already name the subnet.
+    subnet_ids = [relationship['resourceId'] for relationship in relationships if relationship.get('resourceType') == 'AWS::EC2::Subnet']
+    if subnet_ids:
+        return subnet_ids
+
+    instance_ids = [relationship['resourceId'] for relationship in relationships if relationship.get('resourceType') == 'AWS::EC2::Instance']
+    for attachment in configuration_item['configuration'].get('attachments') or []:
+        if 'instanceId' in attachment and attachment['instanceId'] not in instance_ids:
+            instance_ids.append(attachment['instanceId'])
+    if not instance_ids:
+        return []
+    return list(get_subnet_ids(instance_ids, event).values())
 
 def is_in_subnet_exception_list(configuration_item, subnet_exception_list, event):
-    if 'attachments' in configuration_item['configuration']:
-        for attachment in configuration_item['configuration']['attachments']:
-            if 'instanceId' in attachment:
-                subnet_id = get_subnet_id(attachment['instanceId'], event)
-                if subnet_id in subnet_exception_list:
-                    return True
+    for subnet_id in get_attached_subnet_ids(configuration_item, event):
+        if subnet_id in subnet_exception_list:
+            return True
     return False
 
+# Map the ID of all the EC2 instances of the region to their subnet ID.
+def get_instance_subnet_ids(ec2_client, event):
+    now = time.time()
+    remove_expired_instance_subnets(now)
+    instance_subnet_ids = {}
+    for page in ec2_client.get_paginator('describe_instances').paginate():
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                if 'SubnetId' in instance:
+                    instance_subnet_ids[instance['InstanceId']] = instance['SubnetId']
+                    INSTANCE_SUBNET_CACHE[get_instance_cache_key(event, instance['InstanceId'])] = (instance['SubnetId'], now)
+    return instance_subnet_ids
+
+def get_volume_compliance(volume_id, encrypted, kms_key_id, is_in_subnet_exception, valid_rule_parameters):
+    """Return the compliance type and the annotation of a volume.
+
+    Keyword arguments:
+    volume_id -- the ID of the EBS volume
+    encrypted -- True if the volume is encrypted
+    kms_key_id -- the ARN of the KMS key encrypting the volume
+    is_in_subnet_exception -- a function returning True if the volume is attached to an instance in the SubnetExceptionList, called only when needed
+    valid_rule_parameters -- the output of the evaluate_parameters() representing validated parameters of the Config Rule
+    """
+    if 'VolumeExceptionList' in valid_rule_parameters:
+        if volume_id in valid_rule_parameters['VolumeExceptionList']:
+            return 'COMPLIANT', 'This EBS volume is part of the exception list.'
+
+    if 'SubnetExceptionList' in valid_rule_parameters:
+        if is_in_subnet_exception():
+            return 'COMPLIANT', 'This EBS volume is attached to an EC2 instance in a subnet which is part the exception list.'
+
+    if encrypted:
+        if 'KmsIdList' in valid_rule_parameters:
+            if kms_key_id.split('/')[1] not in valid_rule_parameters['KmsIdList']:
+                return 'NON_COMPLIANT', 'This EBS volume is encrypted, but not with a KMS Key listed in the parameter KmsIdList.'
+        return 'COMPLIANT', None
+
+    return 'NON_COMPLIANT', None
+
+# Evaluate all the volumes of the region, on a ScheduledNotification.
+def evaluate_all_volumes(event, valid_rule_parameters):
+    ec2_client = get_client('ec2', event)
+    instance_subnet_ids = {}
+    if 'SubnetExceptionList' in valid_rule_parameters:
+        instance_subnet_ids = get_instance_subnet_ids(ec2_client, event)
+
+    evaluations = []
+    for page in ec2_client.get_paginator('describe_volumes').paginate():
+        for volume in page['Volumes']:
+            attached_subnet_ids = [instance_subnet_ids.get(attachment.get('InstanceId')) for attachment in volume.get('Attachments', [])]
+            compliance_type, annotation = get_volume_compliance(
+                volume['VolumeId'],
+                volume['Encrypted'],
+                volume.get('KmsKeyId'),
+                lambda: any(subnet_id in valid_rule_parameters['SubnetExceptionList'] for subnet_id in attached_subnet_ids),
+                valid_rule_parameters)
+            evaluations.append(build_evaluation(volume['VolumeId'], compliance_type, event, annotation=annotation))
+    return evaluations
+
 def evaluate_compliance(event, configuration_item, valid_rule_parameters):
     """Form the evaluation(s) to be return to Config Rules
 
@@ -176,43 +292,24 @@ def evaluate_compliance(event, configuration_item, valid_rule_parameters):
     3 -- if None or an empty string, list or dict is returned, the Boilerplate code will put a "shadow" evaluation to feedback that the evaluation took place properly
     """
 
-    if 'VolumeExceptionList' in valid_rule_parameters:
-        if configuration_item['configuration']['volumeId'] in valid_rule_parameters['VolumeExceptionList']:
-            return build_evaluation_from_config_item(
-                configuration_item,
-                'COMPLIANT',
-                'This EBS volume is part of the exception list.')
+    # A ScheduledNotification has no configuration item: all the volumes of the region are evaluated.
+    if not configuration_item:
+        return evaluate_all_volumes(event, valid_rule_parameters)
 
-    if 'SubnetExceptionList' in valid_rule_parameters:
-        if is_in_subnet_exception_list(configuration_item, valid_rule_parameters['SubnetExceptionList'], event):
-            return build_evaluation_from_config_item(
-                configuration_item,
-                'COMPLIANT',
-                'This EBS volume is attached to an EC2 instance in a subnet which is part the exception list.')
-
-    if configuration_item['configuration']['encrypted']:
-        if 'KmsIdList' in valid_rule_parameters:
-            if configuration_item['configuration']['kmsKeyId'].split('/')[1] not in valid_rule_parameters['KmsIdList']:
-                return build_evaluation_from_config_item(
-                    configuration_item,
-                    'NON_COMPLIANT',
-                    'This EBS volume is encrypted, but not with a KMS Key listed in the parameter KmsIdList.')
-        return build_evaluation_from_config_item(configuration_item, 'COMPLIANT')
-
-    return build_evaluation_from_config_item(configuration_item, 'NON_COMPLIANT')
+    configuration = configuration_item['configuration']
+    compliance_type, annotation = get_volume_compliance(
+        configuration['volumeId'],
+        configuration['encrypted'],
+        configuration['kmsKeyId'],
+        lambda: is_in_subnet_exception_list(configuration_item, valid_rule_parameters['SubnetExceptionList'], event),
+        valid_rule_parameters)
+    return build_evaluation_from_config_item(configuration_item, compliance_type, annotation)
 
 # Parameter Validation Helper Functions END
 
 # KMS ID Validation
 def validate_kms_id(kms_id):
-    if '-' not in kms_id or kms_id[0] == '-' or kms_id[-1] == '-' or '--' in kms_id:
-        return False
-    kms_id_elements = kms_id.split('-')
-    for element in kms_id_elements:
-        if (element.isalnum() and element.islower()) or element.isdigit():
-            continue
-        return False
-    return True
+    return bool(KMS_ID_PATTERN.match(kms_id))
 
 def verify_kms_id_list(kms_id_list):
     for kms_id in kms_id_list:
@@ -223,7 +320,7 @@ def verify_kms_id_list(kms_id_list):
 # Volume Id Validation
 def verify_volume_exception_list(vol_exception_list):
     for vol_id in vol_exception_list:
-        if vol_id.startswith('vol-') and vol_id.split('-')[1].isalnum() and vol_id.islower():
+        if VOLUME_ID_PATTERN.match(vol_id):
             continue
         return (False, vol_id)
     return True
@@ -231,7 +328,7 @@ def verify_volume_exception_list(vol_exception_list):
 # Subnet Id Validation
 def verify_subnet_exception_list(subnet_ids):
     for subnet_id in subnet_ids:
-        if subnet_id.startswith('subnet-') and subnet_id[7:].isalnum() and subnet_id.islower():
+        if SUBNET_ID_PATTERN.match(subnet_id):
             continue
         return (False, subnet_id)
     return True
@@ -253,7 +350,7 @@ def evaluate_parameters(rule_parameters):
         kms_id_list_check = verify_kms_id_list(kms_id_list)
         if isinstance(kms_id_list_check, tuple) and not kms_id_list_check[0]:
             raise ValueError('Invalid KMS ID specified: {}'.format(kms_id_list_check[1]))
-        valid_rule_parameters['KmsIdList'] = kms_id_list
+        valid_rule_parameters['KmsIdList'] = frozenset(kms_id_list)
 
     if 'VolumeExceptionList' in rule_parameters:
         vol_exception_split = rule_parameters['VolumeExceptionList'].split(',')
@@ -261,7 +358,7 @@ def evaluate_parameters(rule_parameters):
         vol_exception_list_check = verify_volume_exception_list(vol_exception_list)
         if isinstance(vol_exception_list_check, tuple) and not vol_exception_list_check[0]:
             raise ValueError('Invalid Volume ID specified: {}'.format(vol_exception_list_check[1]))
-        valid_rule_parameters['VolumeExceptionList'] = vol_exception_list
+        valid_rule_parameters['VolumeExceptionList'] = frozenset(vol_exception_list)
 
     if 'SubnetExceptionList' in rule_parameters:
         sub_exception_split = rule_parameters['SubnetExceptionList'].split(',')
@@ -269,7 +366,7 @@ def evaluate_parameters(rule_parameters):
         sub_exception_list_check = verify_subnet_exception_list(sub_exception_list)
         if isinstance(sub_exception_list_check, tuple) and not sub_exception_list_check[0]:
             raise ValueError('Invalid Subnet ID specified: {}'.format(sub_exception_list_check[1]))
-        valid_rule_parameters['SubnetExceptionList'] = sub_exception_list
+        valid_rule_parameters['SubnetExceptionList'] = frozenset(sub_exception_list)
 
     return valid_rule_parameters
 
@@ -277,20 +374,12 @@ def evaluate_parameters(rule_parameters):
 # Helper Functions #
 ####################
 
-# Build an error to be displayed in the logs when the parameter is invalid.
-def build_parameters_value_error_response(ex):
-    """Return an error dictionary when the evaluate_parameters() raises a ValueError.
+# The Boilerplate Code of the Rule Development Kit is shared by all the Rules in rule_runtime.py.
+RULE = sys.modules[__name__]
 
-    Keyword arguments:
-    ex -- Exception text
-    """
-    return  build_error_response(internalErrorMessage="Parameter value is invalid",
-                                 internalErrorDetails="An ValueError was raised during the validation of the Parameter value",
-                                 customerErrorCode="InvalidParameterValueException",
-                                 customerErrorMessage=str(ex))
+# Set by the lambda_handler() to the Config client of the invocation.
+AWS_CONFIG_CLIENT = None
 
-# This gets the client after assuming the Config service role
-# either in the same AWS account or cross-account.
 def get_client(service, event):
     """Return the service boto client. It should be used instead of directly calling the client.
 
@@ -298,15 +387,8 @@ def get_client(service, event):
     service -- the service name used for calling the boto.client()
     event -- the event variable given in the lambda handler
     """
-    if not ASSUME_ROLE_MODE:
-        return boto3.client(service)
-    credentials = get_assume_role_credentials(event["executionRoleArn"])
-    return boto3.client(service, aws_access_key_id=credentials['AccessKeyId'],
-                        aws_secret_access_key=credentials['SecretAccessKey'],
-                        aws_session_token=credentials['SessionToken']
-                       )
-
-# This generate an evaluation for config
+    return rule_runtime.get_client(RULE, service, event)
+
 def build_evaluation(resource_id, compliance_type, event, resource_type=DEFAULT_RESOURCE_TYPE, annotation=None):
     """Form an evaluation as a dictionary. Usually suited to report on scheduled rules.
 
@@ -317,14 +399,7 @@ def build_evaluation(resource_id, compliance_type, event, resource_type=DEFAULT_
     resource_type -- the CloudFormation resource type (or AWS::::Account) to report on the rule (default DEFAULT_RESOURCE_TYPE)
     annotation -- an annotation to be added to the evaluation (default None)
     """
-    eval_cc = {}
-    if annotation:
-        eval_cc['Annotation'] = annotation
-    eval_cc['ComplianceResourceType'] = resource_type
-    eval_cc['ComplianceResourceId'] = resource_id
-    eval_cc['ComplianceType'] = compliance_type
-    eval_cc['OrderingTimestamp'] = str(json.loads(event['invokingEvent'])['notificationCreationTime'])
-    return eval_cc
+    return rule_runtime.build_evaluation(resource_id, compliance_type, event, resource_type, annotation)
 
 def build_evaluation_from_config_item(configuration_item, compliance_type, annotation=None):
     """Form an evaluation as a dictionary. Usually suited to report on configuration change rules.
@@ -334,232 +409,7 @@ def build_evaluation_from_config_item(configuration_item, compliance_type, annot
     compliance_type -- either COMPLIANT, NON_COMPLIANT or NOT_APPLICABLE
     annotation -- an annotation to be added to the evaluation (default None)
     """
-    eval_ci = {}
-    if annotation:
-        eval_ci['Annotation'] = annotation
-    eval_ci['ComplianceResourceType'] = configuration_item['resourceType']
-    eval_ci['ComplianceResourceId'] = configuration_item['resourceId']
-    eval_ci['ComplianceType'] = compliance_type
-    eval_ci['OrderingTimestamp'] = configuration_item['configurationItemCaptureTime']
-    return eval_ci
-
-####################
-# Boilerplate Code #
-####################
+    return rule_runtime.build_evaluation_from_config_item(configuration_item, compliance_type, annotation)
 
-# Helper function used to validate input
-def check_defined(reference, reference_name):
-    if not reference:
-        raise Exception('Error: ', reference_name, 'is not defined')
-    return reference
-
-# Check whether the message is OversizedConfigurationItemChangeNotification or not
-def is_oversized_changed_notification(message_type):
-    check_defined(message_type, 'messageType')
-    return message_type == 'OversizedConfigurationItemChangeNotification'
-
-# Check whether the message is a ScheduledNotification or not.
-def is_scheduled_notification(message_type):
-    check_defined(message_type, 'messageType')
-    return message_type == 'ScheduledNotification'
-
-# Get configurationItem using getResourceConfigHistory API
-# in case of OversizedConfigurationItemChangeNotification
-def get_configuration(resource_type, resource_id, configuration_capture_time):
-    result = AWS_CONFIG_CLIENT.get_resource_config_history(
-        resourceType=resource_type,
-        resourceId=resource_id,
-        laterTime=configuration_capture_time,
-        limit=1)
-    configurationItem = result['configurationItems'][0]
-    return convert_api_configuration(configurationItem)
-
-# Convert from the API model to the original invocation model
-def convert_api_configuration(configurationItem):
-    for k, v in configurationItem.items():
-        if isinstance(v, datetime.datetime):
-            configurationItem[k] = str(v)
-    configurationItem['awsAccountId'] = configurationItem['accountId']
-    configurationItem['ARN'] = configurationItem['arn']
-    configurationItem['configurationStateMd5Hash'] = configurationItem['configurationItemMD5Hash']
-    configurationItem['configurationItemVersion'] = configurationItem['version']
-    configurationItem['configuration'] = json.loads(configurationItem['configuration'])
-    if 'relationships' in configurationItem:
-        for i in range(len(configurationItem['relationships'])):
-            configurationItem['relationships'][i]['name'] = configurationItem['relationships'][i]['relationshipName']
-    return configurationItem
-
-# Based on the type of message get the configuration item
-# either from configurationItem in the invoking event
-# or using the getResourceConfigHistiry API in getConfiguration function.
-def get_configuration_item(invokingEvent):
-    check_defined(invokingEvent, 'invokingEvent')
-    if is_oversized_changed_notification(invokingEvent['messageType']):
-        configurationItemSummary = check_defined(invokingEvent['configurationItemSummary'], 'configurationItemSummary')
-        return get_configuration(
-            configurationItemSummary['resourceType'],
-            configurationItemSummary['resourceId'],
-            configurationItemSummary['configurationItemCaptureTime'])
-    elif is_scheduled_notification(invokingEvent['messageType']):
-        return None
-    return check_defined(invokingEvent['configurationItem'], 'configurationItem')
-
-# Check whether the resource has been deleted. If it has, then the evaluation is unnecessary.
-def is_applicable(configurationItem, event):
-    try:
-        check_defined(configurationItem, 'configurationItem')
-        check_defined(event, 'event')
-    except:
-        return True
-    status = configurationItem['configurationItemStatus']
-    eventLeftScope = event['eventLeftScope']
-    # if status == 'ResourceDeleted':
-    #     print("Resource Deleted, setting Compliance Status to NOT_APPLICABLE.")
-    return (status == 'OK' or status == 'ResourceDiscovered') and not eventLeftScope
-
-def get_assume_role_credentials(role_arn):
-    sts_client = boto3.client('sts')
-    try:
-        assume_role_response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName="configLambdaExecution")
-        return assume_role_response['Credentials']
-    except botocore.exceptions.ClientError as ex:
-        # Scrub error message for any internal account info leaks
-        # print(str(ex))
-        if 'AccessDenied' in ex.response['Error']['Code']:
-            ex.response['Error']['Message'] = "AWS Config does not have permission to assume the IAM role."
-        else:
-            ex.response['Error']['Message'] = "InternalError"
-            ex.response['Error']['Code'] = "InternalError"
-        raise ex
-
-# This removes older evaluation (usually useful for periodic rule not reporting on AWS::::Account).
-def clean_up_old_evaluations(latest_evaluations, event):
-
-    cleaned_evaluations = []
-
-    old_eval = AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule(
-        ConfigRuleName=event['configRuleName'],
-        ComplianceTypes=['COMPLIANT', 'NON_COMPLIANT'],
-        Limit=100)
-
-    old_eval_list = []
-
-    while True:
-        for old_result in old_eval['EvaluationResults']:
-            old_eval_list.append(old_result)
-        if 'NextToken' in old_eval:
-            next_token = old_eval['NextToken']
-            old_eval = AWS_CONFIG_CLIENT.get_compliance_details_by_config_rule(
-                ConfigRuleName=event['configRuleName'],
-                ComplianceTypes=['COMPLIANT', 'NON_COMPLIANT'],
-                Limit=100,
-                NextToken=next_token)
-        else:
-            break
-
-    for old_eval in old_eval_list:
-        old_resource_id = old_eval['EvaluationResultIdentifier']['EvaluationResultQualifier']['ResourceId']
-        newer_founded = False
-        for latest_eval in latest_evaluations:
-            if old_resource_id == latest_eval['ComplianceResourceId']:
-                newer_founded = True
-        if not newer_founded:
-            cleaned_evaluations.append(build_evaluation(old_resource_id, "NOT_APPLICABLE", event))
-
-    return cleaned_evaluations + latest_evaluations
-
-# This decorates the lambda_handler in rule_code with the actual PutEvaluation call
 def lambda_handler(event, context):
-
-    global AWS_CONFIG_CLIENT
-
-    #print(event)
-    check_defined(event, 'event')
-    invoking_event = json.loads(event['invokingEvent'])
-    rule_parameters = {}
-    if 'ruleParameters' in event:
-        rule_parameters = json.loads(event['ruleParameters'])
-
-    try:
-        valid_rule_parameters = evaluate_parameters(rule_parameters)
-    except ValueError as ex:
-        return build_parameters_value_error_response(ex)
-
-    try:
-        AWS_CONFIG_CLIENT = get_client('config', event)
-        if invoking_event['messageType'] in ['ConfigurationItemChangeNotification', 'ScheduledNotification', 'OversizedConfigurationItemChangeNotification']:
-            configuration_item = get_configuration_item(invoking_event)
-            if is_applicable(configuration_item, event):
-                compliance_result = evaluate_compliance(event, configuration_item, valid_rule_parameters)
-            else:
-                compliance_result = "NOT_APPLICABLE"
-        else:
-            return build_internal_error_response('Unexpected message type', str(invoking_event))
-    except botocore.exceptions.ClientError as ex:
-        if is_internal_error(ex):
-            return build_internal_error_response("Unexpected error while completing API request", str(ex))
-        return build_error_response(
-            "Customer error while making API request",
-            str(ex),
-            ex.response['Error']['Code'],
-            ex.response['Error']['Message'])
-    except ValueError as ex:
-        return build_internal_error_response(str(ex), str(ex))
-
-    evaluations = []
-    latest_evaluations = []
-
-    if not compliance_result:
-        latest_evaluations.append(build_evaluation(event['accountId'], "NOT_APPLICABLE", event, resource_type='AWS::::Account'))
-        evaluations = clean_up_old_evaluations(latest_evaluations, event)
-    elif isinstance(compliance_result, str):
-        evaluations.append(build_evaluation_from_config_item(configuration_item, compliance_result))
-    elif isinstance(compliance_result, list):
-        for evaluation in compliance_result:
-            missing_fields = False
-            for field in ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp'):
-                if field not in evaluation:
-                    # print("Missing " + field + " from custom evaluation.")
-                    missing_fields = True
-
-            if not missing_fields:
-                latest_evaluations.append(evaluation)
-        evaluations = clean_up_old_evaluations(latest_evaluations, event)
-    elif isinstance(compliance_result, dict):
-        missing_fields = False
-        for field in ('ComplianceResourceType', 'ComplianceResourceId', 'ComplianceType', 'OrderingTimestamp'):
-            if field not in compliance_result:
-                # print("Missing " + field + " from custom evaluation.")
-                missing_fields = True
-        if not missing_fields:
-            evaluations.append(compliance_result)
-    else:
-        evaluations.append(build_evaluation_from_config_item(configuration_item, 'NOT_APPLICABLE'))
-
-    # Put together the request that reports the evaluation status
-    resultToken = event['resultToken']
-    testMode = False
-    if resultToken == 'TESTMODE':
-        # Used solely for RDK test to skip actual put_evaluation API call
-        testMode = True
-    # Invoke the Config API to report the result of the evaluation
-    AWS_CONFIG_CLIENT.put_evaluations(Evaluations=evaluations, ResultToken=resultToken, TestMode=testMode)
-    # Used solely for RDK test to be able to test Lambda function
-    return evaluations
-
-def is_internal_error(exception):
-    return ((not isinstance(exception, botocore.exceptions.ClientError)) or exception.response['Error']['Code'].startswith('5')
-            or 'InternalError' in exception.response['Error']['Code'] or 'ServiceError' in exception.response['Error']['Code'])
-
-def build_internal_error_response(internalErrorMessage, internalErrorDetails=None):
-    return build_error_response(internalErrorMessage, internalErrorDetails, 'InternalError', 'InternalError')
-
-def build_error_response(internalErrorMessage, internalErrorDetails=None, customerErrorCode=None, customerErrorMessage=None):
-    error_response = {
-        'internalErrorMessage': internalErrorMessage,
-        'internalErrorDetails': internalErrorDetails,
-        'customerErrorMessage': customerErrorMessage,
-        'customerErrorCode': customerErrorCode
-    }
-    # print(error_response)
-    return error_response
+    return rule_runtime.lambda_handler(RULE, event, context, string_result=rule_runtime.STRING_RESULT_CONFIG_ITEM)
@@ -1,5 +1,7 @@
 import sys
+import os
 import json
+import time
 import unittest
 try:
     from unittest.mock import MagicMock, patch, ANY
@@ -210,7 +212,7 @@ class ComplianceTest(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_Scenario_9_volumeSubnetinSubnetExceptionList(self):
-        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"SubnetId":"subnet-02"}]}]})
+        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"InstanceId":"i-02", "SubnetId":"subnet-02"}]}]})
         rule_parameters = {
             "VolumeExceptionList": "vol-0003",
             "SubnetExceptionList": "subnet-02",
@@ -228,7 +230,7 @@ class ComplianceTest(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_Scenario_10_volumeNotEncrSubnetNotinSubnetList(self):
-        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"SubnetId":"subnet-02"}]}]})
+        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"InstanceId":"i-02", "SubnetId":"subnet-02"}]}]})
         rule_parameters = getRuleParameters(True, '')
         configuration = constructConfiguration(encrypted=False, volumeId="vol-02", attachments=[{"instanceId":"i-02"}])
         invoking_event = constructInvokingEvent(constructConfigItem(configuration, "vol-02"))
@@ -241,7 +243,7 @@ class ComplianceTest(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_Scenario_11_volumeEncryptedNoKMSNoSubnetExceptionNoVolumeException(self):
-        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"SubnetId":"subnet-02"}]}]})
+        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"InstanceId":"i-02", "SubnetId":"subnet-02"}]}]})
         rule_parameters = {"VolumeExceptionList": "vol-0003", "SubnetExceptionList": "subnet-01"}
         configuration = constructConfiguration(
             encrypted=True,
@@ -258,7 +260,7 @@ class ComplianceTest(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_Scenario_12_volumeEncryptedNotWithProperKMSNoSubnetExceptionNoVolumeException(self):
-        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"SubnetId":"subnet-02"}]}]})
+        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"InstanceId":"i-02", "SubnetId":"subnet-02"}]}]})
         rule_parameters = {
             "VolumeExceptionList": "vol-0003",
             "SubnetExceptionList": "subnet-01",
@@ -280,7 +282,7 @@ class ComplianceTest(unittest.TestCase):
         assert_successful_evaluation(self, response, resp_expected)
 
     def test_Scenario_13_volumeEncryptedWithProperKMSNoSubnetExceptionNoVolumeException(self): #Scenario13
-        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"SubnetId":"subnet-02"}]}]})
+        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[{"InstanceId":"i-02", "SubnetId":"subnet-02"}]}]})
         rule_parameters = getRuleParameters(True, '')
         configuration = constructConfiguration(
             encrypted=True,
@@ -297,6 +299,107 @@ class ComplianceTest(unittest.TestCase):
             'vol-02asd'))
         assert_successful_evaluation(self, response, resp_expected)
 
+class ValidParametersTest(unittest.TestCase):
+
+    def test_exception_lists_are_sets(self):
+        valid_rule_parameters = rule.evaluate_parameters({"VolumeExceptionList": "vol-01, vol-02", "SubnetExceptionList": "subnet-01"})
+        self.assertEqual(frozenset(['vol-01', 'vol-02']), valid_rule_parameters['VolumeExceptionList'])
+        self.assertEqual(frozenset(['subnet-01']), valid_rule_parameters['SubnetExceptionList'])
+
+class InstanceSubnetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        rule.INSTANCE_SUBNET_CACHE.clear()
+        ec2_mock.reset_mock()
+        ec2_mock.describe_instances = MagicMock(return_value={"Reservations":[{"Instances":[
+            {"InstanceId":"i-01", "SubnetId":"subnet-01"},
+            {"InstanceId":"i-02", "SubnetId":"subnet-02"}]}]})
+        self.rule_parameters = {"SubnetExceptionList": "subnet-02"}
+
+    def tearDown(self):
+        rule.INSTANCE_SUBNET_CACHE.clear()
+
+    def build_event(self, attachments, relationships=None):
+        configuration = constructConfiguration(encrypted=False, volumeId="vol-01", attachments=attachments)
+        config_item = constructConfigItem(configuration, "vol-01")
+        if relationships:
+            config_item['relationships'] = relationships
+        return build_lambda_configurationchange_event(constructInvokingEvent(config_item), self.rule_parameters)
+
+    def test_instances_described_in_one_call_and_cached(self):
+        event = self.build_event([{"instanceId":"i-01"}, {"instanceId":"i-02"}])
+        response = rule.lambda_handler(event, {})
+        assert_successful_evaluation(self, response, [build_expected_response(
+            'COMPLIANT',
+            'vol-01',
+            annotation='This EBS volume is attached to an EC2 instance in a subnet which is part the exception list.')])
+        ec2_mock.describe_instances.assert_called_once_with(InstanceIds=['i-01', 'i-02'])
+        rule.lambda_handler(event, {})
+        ec2_mock.describe_instances.assert_called_once()
+
+    def test_cached_subnet_expires(self):
+        rule.INSTANCE_SUBNET_CACHE[build_instance_cache_key('i-02')] = ('subnet-02', 0)
+        rule.lambda_handler(self.build_event([{"instanceId":"i-02"}]), {})
+        ec2_mock.describe_instances.assert_called_once_with(InstanceIds=['i-02'])
+
+    def test_expired_subnets_removed(self):
+        rule.INSTANCE_SUBNET_CACHE[build_instance_cache_key('i-03')] = ('subnet-03', 0)
+        rule.lambda_handler(self.build_event([{"instanceId":"i-01"}]), {})
+        self.assertEqual([build_instance_cache_key('i-01'), build_instance_cache_key('i-02')], sorted(rule.INSTANCE_SUBNET_CACHE.keys()))
+
+    def test_subnet_of_other_account_not_used(self):
+        rule.INSTANCE_SUBNET_CACHE[build_instance_cache_key('i-02', '210987654321')] = ('subnet-02', time.time())
+        rule.lambda_handler(self.build_event([{"instanceId":"i-02"}]), {})
+        ec2_mock.describe_instances.assert_called_once_with(InstanceIds=['i-02'])
+
+    def test_subnet_from_relationships(self):
+        relationships = [{"resourceType": "AWS::EC2::Subnet", "resourceId": "subnet-01", "name": "Is contained in Subnet"}]
+        response = rule.lambda_handler(self.build_event([{"instanceId":"i-02"}], relationships), {})
+        assert_successful_evaluation(self, response, [build_expected_response('NON_COMPLIANT', 'vol-01')])
+        ec2_mock.describe_instances.assert_not_called()
+
+class PeriodicSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.assume_role_mode = rule.ASSUME_ROLE_MODE
+        rule.ASSUME_ROLE_MODE = False
+        volumes = [
+            {'VolumeId': 'vol-01', 'Encrypted': False, 'Attachments': [{'InstanceId': 'i-01'}]},
+            {'VolumeId': 'vol-02', 'Encrypted': False, 'Attachments': [{'InstanceId': 'i-02'}]},
+            {'VolumeId': 'vol-03', 'Encrypted': True, 'KmsKeyId': 'arn:aws:kms:us-east-1:123456789012:key/sdf434-dsvfb3-4545-dfvfdv', 'Attachments': []}]
+        instances = [{'InstanceId': 'i-01', 'SubnetId': 'subnet-01'}, {'InstanceId': 'i-02', 'SubnetId': 'subnet-02'}]
+        self.paginators = {
+            'describe_volumes': build_paginator_mock([{'Volumes': volumes[:2]}, {'Volumes': volumes[2:]}]),
+            'describe_instances': build_paginator_mock([{'Reservations': [{'Instances': instances}]}])}
+        ec2_mock.reset_mock()
+        ec2_mock.get_paginator = MagicMock(side_effect=lambda operation: self.paginators[operation])
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(return_value={'EvaluationResults': [
+            build_old_evaluation('vol-01', DEFAULT_RESOURCE_TYPE),
+            build_old_evaluation('vol-00', DEFAULT_RESOURCE_TYPE)]})
+
+    def tearDown(self):
+        rule.ASSUME_ROLE_MODE = self.assume_role_mode
+        rule.rule_runtime.CLIENT_CACHE.clear()
+        rule.INSTANCE_SUBNET_CACHE.clear()
+
+    def test_all_volumes_evaluated(self):
+        rule_parameters = {"SubnetExceptionList": "subnet-01"}
+        response = rule.lambda_handler(build_lambda_scheduled_event(json.dumps(rule_parameters)), {})
+        resp_expected = [
+            build_expected_response('NOT_APPLICABLE', 'vol-00'),
+            build_expected_response(
+                'COMPLIANT',
+                'vol-01',
+                annotation='This EBS volume is attached to an EC2 instance in a subnet which is part the exception list.'),
+            build_expected_response('NON_COMPLIANT', 'vol-02'),
+            build_expected_response('COMPLIANT', 'vol-03')]
+        assert_successful_evaluation(self, response, resp_expected, 4)
+        ec2_mock.describe_instances.assert_not_called()
+
+    def test_instances_not_listed_without_subnet_exception(self):
+        rule.lambda_handler(build_lambda_scheduled_event(), {})
+        ec2_mock.get_paginator.assert_called_once_with('describe_volumes')
+
 ####################
 # Helper Functions #
 ####################
@@ -383,6 +486,20 @@ def sts_mock():
     sts_client_mock.reset_mock(return_value=True)
     sts_client_mock.assume_role = MagicMock(return_value=assume_role_response)
 
+def build_old_evaluation(resource_id, resource_type=None):
+    qualifier = {'ResourceId': resource_id}
+    if resource_type:
+        qualifier['ResourceType'] = resource_type
+    return {'EvaluationResultIdentifier': {'EvaluationResultQualifier': qualifier}}
+
+def build_instance_cache_key(instance_id, account_id='123456789012'):
+    return (account_id, os.environ.get('AWS_REGION'), instance_id)
+
+def build_paginator_mock(pages):
+    paginator_mock = MagicMock()
+    paginator_mock.paginate = MagicMock(return_value=pages)
+    return paginator_mock
+
 ##################
 # Common Testing #
 ##################
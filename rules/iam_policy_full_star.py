@@ -0,0 +1,100 @@
+#
+# This file made available under CC0 1.0 Universal (https://creativecommons.org/publicdomain/zero/1.0/legalcode)
+#
+# Can be used stand-alone or with the Rule Compliance Engine: https://github.com/awslabs/aws-config-engine-for-compliance-as-code
+#
+'''
+Evaluation shared by the IAM_USER_NO_POLICY_FULL_STAR, IAM_ROLE_NO_POLICY_FULL_STAR and IAM_GROUP_NO_POLICY_FULL_STAR Rules.
+
+Each of these Rules has a copy of this file and of rule_runtime.py in its folder, kept identical by rule_runtime_test.py.
+A Rule gives its own module and the IAM entity it reports on:
+
+    def evaluate_compliance(event, configuration_item, valid_rule_parameters):
+        return iam_policy_full_star.evaluate_compliance(RULE, event, configuration_item, 'role')
+'''
+import rule_runtime
+
+def evaluate_compliance(rule, event, configuration_item, entity):
+    """Return NON_COMPLIANT if an inline or managed policy of the IAM entity allows the Action "*", COMPLIANT otherwise.
+
+    Keyword arguments:
+    rule -- the module of the Rule
+    event -- the event variable given in the lambda handler
+    configuration_item -- the configurationItem dictionary in the invokingEvent
+    entity -- the IAM entity reported by the Rule: user, role or group
+    """
+    entity_name = configuration_item['configuration'][entity + 'Name']
+    entity_parameter = {entity.capitalize() + 'Name': entity_name}
+    iam_client = rule_runtime.get_client(rule, 'iam', event)
+
+    # Inline policies
+    inline_policy_names = get_all_inline_policy_names(iam_client, entity, entity_parameter)
+    for policy_name in inline_policy_names:
+        policy_document = getattr(iam_client, 'get_' + entity + '_policy')(PolicyName=policy_name, **entity_parameter)['PolicyDocument']
+        if is_statements_include_full_star_allow(policy_document['Statement']):
+            return rule_runtime.build_evaluation_from_config_item(configuration_item, "NON_COMPLIANT", annotation='An inline policy "' + policy_name + '" attached to the ' + entity + ' "' + entity_name + '" has full star allow permissions.')
+
+    # Managed policies
+    managed_policy_arn_and_name = get_all_managed_policy_arn_and_name(iam_client, entity, entity_parameter)
+    for policy_arn, policy_name in managed_policy_arn_and_name.items():
+        get_policy = iam_client.get_policy(PolicyArn=policy_arn)
+        version = get_policy['Policy']['DefaultVersionId']
+        get_policy_version = iam_client.get_policy_version(PolicyArn=policy_arn, VersionId=version)
+        if is_statements_include_full_star_allow(get_policy_version['PolicyVersion']['Document']['Statement']):
+            return rule_runtime.build_evaluation_from_config_item(configuration_item, "NON_COMPLIANT", annotation='A managed policy with name "' + policy_name + '" attached to the ' + entity + ' "' + entity_name + '" has full star allow permissions.')
+
+    return "COMPLIANT"
+
+def get_all_inline_policy_names(iam_client, entity, entity_parameter):
+    all_inline_policies = []
+    list_policies = getattr(iam_client, 'list_' + entity + '_policies')
+    list_policy_names = list_policies(MaxItems=1000, **entity_parameter)
+    while True:
+        all_inline_policies += list_policy_names['PolicyNames']
+        if 'Marker' in list_policy_names:
+            list_policy_names = list_policies(MaxItems=1000, Marker=list_policy_names['Marker'], **entity_parameter)
+        else:
+            break
+    return all_inline_policies
+
+def get_all_managed_policy_arn_and_name(iam_client, entity, entity_parameter):
+    all_managed_policies_arn_and_name = {}
+    list_attached_policies = getattr(iam_client, 'list_attached_' + entity + '_policies')
+    list_policy_arn = list_attached_policies(MaxItems=1000, **entity_parameter)
+    while True:
+        for policy_dict in list_policy_arn['AttachedPolicies']:
+            all_managed_policies_arn_and_name[policy_dict['PolicyArn']] = policy_dict['PolicyName']
+        if 'Marker' in list_policy_arn:
+            list_policy_arn = list_attached_policies(MaxItems=1000, Marker=list_policy_arn['Marker'], **entity_parameter)
+        else:
+            break
+    return all_managed_policies_arn_and_name
+
+def is_statements_include_full_star_allow(statements):
+    statement_list = []
+    if isinstance(statements, dict):
+        statement_list = [statements]
+    elif isinstance(statements, list):
+        statement_list = statements
+    else:
+        print("Not recognized statement type:")
+        print(statements)
+        return False
+
+    for statement in statement_list:
+        if statement['Effect'] == 'Deny':
+            continue
+
+        if 'Action' not in statement:
+            print("No 'Action' in statement")
+            print(statement)
+            continue
+
+        if isinstance(statement['Action'], list):
+            for action in statement['Action']:
+                if action == "*":
+                    return True
+        else:
+            if statement['Action'] == "*":
+                return True
+    return False
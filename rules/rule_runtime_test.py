@@ -0,0 +1,293 @@
+import json
+import datetime
+import glob
+import os
+import types
+import unittest
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    import mock
+    from mock import MagicMock, patch
+import botocore
+from botocore.exceptions import ClientError
+
+import rule_runtime
+
+##############
+# Parameters #
+##############
+
+# Define the default resource to report to Config Rules
+DEFAULT_RESOURCE_TYPE = 'AWS::EC2::Volume'
+
+#############
+# Main Code #
+#############
+
+config_client_mock = MagicMock()
+sts_client_mock = MagicMock()
+ec2_client_mock = MagicMock()
+
+class Boto3Mock():
+    def client(self, client_name, *args, **kwargs):
+        if client_name == 'config':
+            return config_client_mock
+        elif client_name == 'sts':
+            return sts_client_mock
+        elif client_name == 'ec2':
+            return ec2_client_mock
+        else:
+            raise Exception("Attempting to create an unknown client")
+
+# A Rule as given to the runtime by its lambda_handler()
+rule = types.ModuleType('SAMPLE_RULE')
+rule.boto3 = Boto3Mock()
+rule.DEFAULT_RESOURCE_TYPE = DEFAULT_RESOURCE_TYPE
+rule.ASSUME_ROLE_MODE = True
+rule.AWS_CONFIG_CLIENT = None
+
+class RuntimeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rule.ASSUME_ROLE_MODE = True
+        rule.evaluate_parameters = MagicMock(side_effect=lambda rule_parameters: rule_parameters)
+        rule.evaluate_compliance = MagicMock(return_value='COMPLIANT')
+        sts_mock()
+        config_client_mock.reset_mock()
+        config_client_mock.put_evaluations = MagicMock(return_value={'FailedEvaluations': []})
+
+    def tearDown(self):
+        rule_runtime.CREDENTIALS_CACHE.clear()
+        rule_runtime.CLIENT_CACHE.clear()
+        rule_runtime.PARAMETERS_CACHE.clear()
+
+class StringResultTest(RuntimeTestCase):
+
+    def test_config_item_or_account(self):
+        response = rule_runtime.lambda_handler(rule, build_lambda_configurationchange_event(), {})
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', 'vol-01')])
+        response = rule_runtime.lambda_handler(rule, build_lambda_scheduled_event(), {})
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', '123456789012')])
+
+    def test_account(self):
+        response = rule_runtime.lambda_handler(rule, build_lambda_configurationchange_event(), {}, string_result=rule_runtime.STRING_RESULT_ACCOUNT)
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', '123456789012')])
+
+    def test_config_item(self):
+        response = rule_runtime.lambda_handler(rule, build_lambda_configurationchange_event(), {}, string_result=rule_runtime.STRING_RESULT_CONFIG_ITEM)
+        assert_successful_evaluation(self, response, [build_expected_response('COMPLIANT', 'vol-01')])
+
+class ParametersCacheTest(RuntimeTestCase):
+
+    def test_parameters_evaluated_once(self):
+        event = build_lambda_configurationchange_event({"VolumeExceptionList": "vol-01"})
+        rule_runtime.lambda_handler(rule, event, {})
+        rule_runtime.lambda_handler(rule, event, {})
+        rule.evaluate_parameters.assert_called_once_with({"VolumeExceptionList": "vol-01"})
+
+    def test_invalid_parameters_not_cached(self):
+        rule.evaluate_parameters = MagicMock(side_effect=ValueError('Invalid Volume ID specified: asdef'))
+        event = build_lambda_configurationchange_event({"VolumeExceptionList": "asdef"})
+        rule_runtime.lambda_handler(rule, event, {})
+        response = rule_runtime.lambda_handler(rule, event, {})
+        self.assertEqual(2, rule.evaluate_parameters.call_count)
+        assert_customer_error_response(self, response, 'InvalidParameterValueException')
+
+class CredentialsCacheTest(RuntimeTestCase):
+
+    def test_credentials_reused_until_expiration_margin(self):
+        sts_mock(expiration_minutes=60)
+        event = build_lambda_scheduled_event()
+        ec2_client = rule_runtime.get_client(rule, 'ec2', event)
+        self.assertIs(ec2_client, rule_runtime.get_client(rule, 'ec2', event))
+        rule_runtime.get_client(rule, 'config', event)
+        sts_client_mock.assume_role.assert_called_once()
+
+    def test_credentials_assumed_again_when_expiring(self):
+        sts_mock(expiration_minutes=5)
+        event = build_lambda_scheduled_event()
+        rule_runtime.get_client(rule, 'ec2', event)
+        rule_runtime.get_client(rule, 'ec2', event)
+        self.assertEqual(2, sts_client_mock.assume_role.call_count)
+
+    def test_credentials_without_expiration_not_cached(self):
+        event = build_lambda_scheduled_event()
+        rule_runtime.get_client(rule, 'ec2', event)
+        rule_runtime.get_client(rule, 'ec2', event)
+        self.assertEqual(2, sts_client_mock.assume_role.call_count)
+        self.assertEqual({}, rule_runtime.CLIENT_CACHE)
+
+    def test_expiring_entries_removed(self):
+        sts_mock(expiration_minutes=5)
+        rule_runtime.get_client(rule, 'ec2', build_lambda_scheduled_event())
+        sts_mock(expiration_minutes=60)
+        event = build_lambda_scheduled_event()
+        event['executionRoleArn'] = 'otherRoleArn'
+        rule_runtime.get_client(rule, 'ec2', event)
+        self.assertEqual(['otherRoleArn'], list(rule_runtime.CREDENTIALS_CACHE.keys()))
+        self.assertEqual(['otherRoleArn'], [cache_key[0] for cache_key in rule_runtime.CLIENT_CACHE])
+
+class RuntimeCopiesTest(unittest.TestCase):
+
+    def test_copies_match_shared_modules(self):
+        # Each Rule importing a shared module is deployed with its own copy of it, i.e. of rules/rule_runtime.py.
+        rules_dir = os.path.dirname(os.path.abspath(__file__))
+        for module_name in ['rule_runtime', 'iam_policy_full_star']:
+            with open(os.path.join(rules_dir, module_name + '.py')) as module_file:
+                module = module_file.read()
+            for rule_file_name in glob.glob(os.path.join(rules_dir, '*', '*.py')):
+                with open(rule_file_name) as rule_file:
+                    if rule_file_name.endswith('_test.py') or 'import ' + module_name + '\n' not in rule_file.read():
+                        continue
+                copy_file_name = os.path.join(os.path.dirname(rule_file_name), module_name + '.py')
+                self.assertTrue(os.path.isfile(copy_file_name), copy_file_name + ' is missing')
+                with open(copy_file_name) as copy_file:
+                    self.assertEqual(module, copy_file.read(), copy_file_name + ' differs from rules/' + module_name + '.py')
+
+class CleanUpOldEvaluationsTest(RuntimeTestCase):
+
+    def test_old_evaluations_not_in_latest_are_not_applicable(self):
+        config_client_mock.get_compliance_details_by_config_rule = MagicMock(side_effect=[
+            {'EvaluationResults': [build_old_evaluation('vol-01'), build_old_evaluation('vol-02')], 'NextToken': 'page-2'},
+            {'EvaluationResults': [build_old_evaluation('vol-03')]}])
+        event = build_lambda_scheduled_event()
+        latest_evaluations = [rule_runtime.build_evaluation('vol-02', 'COMPLIANT', event, DEFAULT_RESOURCE_TYPE)]
+        response = rule_runtime.clean_up_old_evaluations(rule, config_client_mock, latest_evaluations, event)
+        resp_expected = [
+            build_expected_response('NOT_APPLICABLE', 'vol-01'),
+            build_expected_response('NOT_APPLICABLE', 'vol-03'),
+            build_expected_response('COMPLIANT', 'vol-02')]
+        assert_successful_evaluation(self, response, resp_expected, 3)
+        config_client_mock.get_compliance_details_by_config_rule.assert_called_with(
+            ConfigRuleName='myrule', ComplianceTypes=['COMPLIANT', 'NON_COMPLIANT'], Limit=100, NextToken='page-2')
+
+class PutEvaluationsTest(RuntimeTestCase):
+
+    def setUp(self):
+        super(PutEvaluationsTest, self).setUp()
+        event = build_lambda_scheduled_event()
+        self.evaluations = [rule_runtime.build_evaluation('vol-' + str(i), 'COMPLIANT', event, DEFAULT_RESOURCE_TYPE) for i in range(250)]
+
+    def test_evaluations_sent_by_chunks(self):
+        failed_evaluations = rule_runtime.put_evaluations(config_client_mock, self.evaluations, 'token')
+        self.assertEqual([], failed_evaluations)
+        chunk_sizes = sorted(len(call[1]['Evaluations']) for call in config_client_mock.put_evaluations.call_args_list)
+        self.assertEqual([50, 100, 100], chunk_sizes)
+
+    @patch.object(rule_runtime.time, 'sleep')
+    def test_throttled_chunk_retried_and_failed_evaluations_reported(self, sleep_mock):
+        config_client_mock.put_evaluations = MagicMock(side_effect=[
+            botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'operation'),
+            {'FailedEvaluations': [self.evaluations[0]]}])
+        failed_evaluations = rule_runtime.put_evaluations(config_client_mock, self.evaluations[:10], 'token')
+        self.assertEqual([self.evaluations[0]], failed_evaluations)
+        self.assertEqual(2, config_client_mock.put_evaluations.call_count)
+        sleep_mock.assert_called_once()
+
+    def test_non_throttling_error_raised(self):
+        config_client_mock.put_evaluations = MagicMock(side_effect=botocore.exceptions.ClientError(
+            {'Error': {'Code': 'InvalidResultTokenException', 'Message': 'invalid'}}, 'operation'))
+        with self.assertRaises(botocore.exceptions.ClientError):
+            rule_runtime.put_evaluations(config_client_mock, self.evaluations, 'token')
+
+####################
+# Helper Functions #
+####################
+
+def build_lambda_configurationchange_event(rule_parameters=None):
+    configuration_item = {
+        'configuration': {},
+        'configurationItemCaptureTime': "2018-07-02T03:37:52.418Z",
+        'configurationItemStatus': "ResourceDiscovered",
+        'resourceType': DEFAULT_RESOURCE_TYPE,
+        'resourceId': 'vol-01'
+    }
+    invoking_event = {
+        'configurationItem': configuration_item,
+        'notificationCreationTime': "2018-07-02T23:05:34.445Z",
+        'messageType': 'ConfigurationItemChangeNotification'
+    }
+    event_to_return = {
+        'configRuleName':'myrule',
+        'executionRoleArn':'roleArn',
+        'eventLeftScope': False,
+        'invokingEvent': json.dumps(invoking_event),
+        'accountId': '123456789012',
+        'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
+        'resultToken':'token'
+    }
+    if rule_parameters:
+        event_to_return['ruleParameters'] = json.dumps(rule_parameters)
+    return event_to_return
+
+def build_lambda_scheduled_event(rule_parameters=None):
+    invoking_event = '{"messageType":"ScheduledNotification","notificationCreationTime":"2017-12-23T22:11:18.158Z"}'
+    event_to_return = {
+        'configRuleName':'myrule',
+        'executionRoleArn':'roleArn',
+        'eventLeftScope': False,
+        'invokingEvent': invoking_event,
+        'accountId': '123456789012',
+        'configRuleArn': 'arn:aws:config:us-east-1:123456789012:config-rule/config-rule-8fngan',
+        'resultToken':'token'
+    }
+    if rule_parameters:
+        event_to_return['ruleParameters'] = json.dumps(rule_parameters)
+    return event_to_return
+
+def build_expected_response(compliance_type, compliance_resource_id, compliance_resource_type=DEFAULT_RESOURCE_TYPE):
+    return {
+        'ComplianceType': compliance_type,
+        'ComplianceResourceId': compliance_resource_id,
+        'ComplianceResourceType': compliance_resource_type
+        }
+
+def assert_successful_evaluation(testClass, response, resp_expected, evaluations_count=1):
+    testClass.assertEqual(evaluations_count, len(response))
+    for i, response_expected in enumerate(resp_expected):
+        testClass.assertEqual(response_expected['ComplianceType'], response[i]['ComplianceType'])
+        testClass.assertEqual(response_expected['ComplianceResourceType'], response[i]['ComplianceResourceType'])
+        testClass.assertEqual(response_expected['ComplianceResourceId'], response[i]['ComplianceResourceId'])
+        testClass.assertTrue(response[i]['OrderingTimestamp'])
+
+def assert_customer_error_response(testClass, response, customerErrorCode=None, customerErrorMessage=None):
+    if customerErrorCode:
+        testClass.assertEqual(customerErrorCode, response['customerErrorCode'])
+    if customerErrorMessage:
+        testClass.assertEqual(customerErrorMessage, response['customerErrorMessage'])
+    testClass.assertTrue(response['customerErrorCode'])
+    testClass.assertTrue(response['customerErrorMessage'])
+
+def sts_mock(expiration_minutes=None):
+    credentials = {
+        "AccessKeyId": "string",
+        "SecretAccessKey": "string",
+        "SessionToken": "string"}
+    if expiration_minutes:
+        credentials['Expiration'] = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=expiration_minutes)
+    sts_client_mock.reset_mock(return_value=True)
+    sts_client_mock.assume_role = MagicMock(return_value={"Credentials": credentials})
+
+def build_old_evaluation(resource_id):
+    return {'EvaluationResultIdentifier': {'EvaluationResultQualifier': {'ResourceId': resource_id, 'ResourceType': DEFAULT_RESOURCE_TYPE}}}
+
+##################
+# Common Testing #
+##################
+
+class TestStsErrors(RuntimeTestCase):
+
+    def test_sts_unknown_error(self):
+        sts_client_mock.assume_role = MagicMock(side_effect=botocore.exceptions.ClientError(
+            {'Error': {'Code': 'unknown-code', 'Message': 'unknown-message'}}, 'operation'))
+        response = rule_runtime.lambda_handler(rule, build_lambda_configurationchange_event(), {})
+        assert_customer_error_response(
+            self, response, 'InternalError', 'InternalError')
+
+    def test_sts_access_denied(self):
+        sts_client_mock.assume_role = MagicMock(side_effect=botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'access-denied'}}, 'operation'))
+        response = rule_runtime.lambda_handler(rule, build_lambda_configurationchange_event(), {})
+        assert_customer_error_response(
+            self, response, 'AccessDenied', 'AWS Config does not have permission to assume the IAM role.')
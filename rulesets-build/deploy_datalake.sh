@@ -6,8 +6,16 @@ keylistfirehose=("$3")
 columnkeylist=("$4")
 accountlist=("$5")
 locationaccountlist=("$6")
+datalakeoutputformat=("${7:-JSON}")
+datalakepartitioning=("${8:-false}")
+otheractiveregions="${9:-none}"
 
-aws cloudformation deploy --stack-name Compliance-Engine-Datalake-DO-NOT-DELETE --template-file ./rulesets-build/compliance-account-analytics-setup.yaml --no-fail-on-empty-changeset --parameter-overrides CentralizedS3BucketConfig="${centralizedbucketconfig[@]}" CentralizedS3BucketComplianceEventName="${centralizedcomplianceevent[@]}" KeyListGeneratedByFirehose="${keylistfirehose[@]}" ColumnKeyList="${columnkeylist[@]}" AccountList="${accountlist[@]}" LocationAccountListCSV="${locationaccountlist[@]}"
+activeregions=("$AWS_DEFAULT_REGION")
+if [ "$otheractiveregions" != "none" ]; then
+  activeregions=("$AWS_DEFAULT_REGION,$otheractiveregions")
+fi
+
+aws cloudformation deploy --stack-name Compliance-Engine-Datalake-DO-NOT-DELETE --template-file ./rulesets-build/compliance-account-analytics-setup.yaml --no-fail-on-empty-changeset --parameter-overrides CentralizedS3BucketConfig="${centralizedbucketconfig[@]}" CentralizedS3BucketComplianceEventName="${centralizedcomplianceevent[@]}" KeyListGeneratedByFirehose="${keylistfirehose[@]}" ColumnKeyList="${columnkeylist[@]}" AccountList="${accountlist[@]}" LocationAccountListCSV="${locationaccountlist[@]}" DatalakeOutputFormat="${datalakeoutputformat[@]}" DatalakePartitioning="${datalakepartitioning[@]}" ActiveRegions="${activeregions[@]}"
 
 response=$(aws cloudformation list-change-sets --stack-name Compliance-Engine-Datalake-DO-NOT-DELETE --query "Summaries[*].ChangeSetName" --output text)
 declare -a changesets=($response)
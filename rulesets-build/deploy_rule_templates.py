@@ -1,7 +1,11 @@
 import sys
+import os
 import json
 import re
 import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
 
 main_region = sys.argv[1]
@@ -12,8 +16,51 @@ default_template_name = "default.json"
 remote_execution_role_name = "AWSConfigAndComplianceAuditRole-DO-NOT-DELETE"
 remote_execution_path_name = "service-role/"
 stack_name = "Compliance-Engine-Benchmark-DO-NOT-DELETE"
+deploy_manifest_name = "deploy-manifest.json"
+deploy_checkpoint_name = "deploy-checkpoint.json"
 
-central_sts_client = boto3.client('sts')
+# Number of regions deployed in parallel, and number of accounts deployed in parallel within each region.
+max_concurrent_regions = int(os.environ.get('MAX_CONCURRENT_REGIONS', '2'))
+max_concurrent_accounts = int(os.environ.get('MAX_CONCURRENT_ACCOUNTS', '10'))
+
+# The stacks being deployed are polled until they reach a terminal state, with a delay growing from the initial to the max delay.
+stack_poll_initial_delay = 5
+stack_poll_max_delay = 30
+stack_poll_timeout = int(os.environ.get('STACK_POLL_TIMEOUT', '1800'))
+stack_success_status = ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
+
+# The accounts whose template is unchanged since their last successful deployment are skipped, unless FORCE_DEPLOY is true.
+force_deploy = os.environ.get('FORCE_DEPLOY', 'false') == 'true'
+
+# In CHANGESET mode, a change set is created in all the accounts and the changes are reported for the whole fleet.
+# If CHANGESET_EXECUTE is true, the change sets are then executed by waves of CHANGESET_WAVE_SIZE accounts per region.
+deploy_mode = os.environ.get('DEPLOY_MODE', 'DIRECT')
+change_set_execute = os.environ.get('CHANGESET_EXECUTE', 'false') == 'true'
+change_set_wave_size = int(os.environ.get('CHANGESET_WAVE_SIZE', '50'))
+change_set_prefix = "ComplianceEngine-"
+change_set_name = change_set_prefix + datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+change_set_report_prefix = "changeset-report/"
+
+# The accounts are deployed by waves, ordered by their "wave:<number>" tag in the account list. The accounts without
+# such tag are deployed in the last wave. Between 2 waves, the deployment pauses ROLLOUT_WAVE_PAUSE seconds and, if
+# ROLLOUT_HEALTH_GATE is true, waits for the crawler Rule of the accounts just deployed to be COMPLIANT.
+account_list_location = os.environ.get('ACCOUNT_LIST', 'none')
+rollout_wave_tag_prefix = "wave:"
+rollout_wave_pause = int(os.environ.get('ROLLOUT_WAVE_PAUSE', '0'))
+rollout_health_gate = os.environ.get('ROLLOUT_HEALTH_GATE', 'false') == 'true'
+rollout_health_gate_timeout = int(os.environ.get('ROLLOUT_HEALTH_GATE_TIMEOUT', '900'))
+
+# The progress of each region is saved every CHECKPOINT_INTERVAL seconds. If the previous run was interrupted (i.e. by
+# the build timeout) and DEPLOY_RESUME is true, the accounts it completed with the same template are not deployed again.
+checkpoint_interval = int(os.environ.get('CHECKPOINT_INTERVAL', '30'))
+deploy_resume = os.environ.get('DEPLOY_RESUME', 'true') == 'true'
+
+# The assumed role credentials of each account are reused by all the regions, until they are about to expire.
+credentials_expiration_margin = datetime.timedelta(minutes=5)
+
+# All the clients are created from the same session, the STS client is shared by all the workers.
+central_session = boto3.session.Session()
+central_sts_client = central_session.client('sts')
 central_account_id = central_sts_client.get_caller_identity()["Account"]
 
 all_region_list = []
@@ -22,125 +69,610 @@ if other_regions != 'none':
     other_regions_list = other_regions.split(',')
     all_region_list += other_regions_list
 
-s3 = boto3.resource('s3')
-s3_client = boto3.client('s3')
+s3_client = central_session.client('s3')
 
-for region in all_region_list:
-    template_bucket_name = template_bucket_name_prefix + '-' + region
-    default_template_obj = s3.Object(template_bucket_name, default_template_name)
-    default_template = json.loads(default_template_obj.get()['Body'].read().decode('utf-8'))
+remote_credentials_cache = {}
+remote_credentials_locks = {}
+remote_client_cache = {}
+cache_lock = threading.Lock()
 
-    contents = s3_client.list_objects(Bucket=template_bucket_name)['Contents']
-    list_of_account_to_review = []
+def log(region, remote_account_id, message):
+    # The lines are written in one call, so that the logs of the workers are not interleaved.
+    prefix = "[" + region + "]"
+    if remote_account_id:
+        prefix += "[" + remote_account_id + "]"
+    sys.stdout.write(prefix + " " + message + "\n")
+    sys.stdout.flush()
 
-    for s3_object in contents:
-        #Assumes S3 template keys are of the form <12-digit-account-id>.json
-        key = s3_object["Key"]
+def get_remote_credentials(remote_account_id):
+    with cache_lock:
+        account_lock = remote_credentials_locks.setdefault(remote_account_id, threading.Lock())
 
-        if not re.match('^[0-9]{12}\.json$', key):
-            #Skip this one
-            print("Skipping " + key)
-            continue
+    # The lock of the account avoids assuming the role several times when the regions of an account are deployed at the same time.
+    with account_lock:
+        credentials = remote_credentials_cache.get(remote_account_id)
+        if credentials and credentials['Expiration'] - datetime.datetime.now(datetime.timezone.utc) > credentials_expiration_margin:
+            return credentials
 
-        remote_account_id = key.split(".")[0]
+        response = central_sts_client.assume_role(
+            RoleArn='arn:aws:iam::'+remote_account_id+':role/' + remote_execution_path_name + remote_execution_role_name,
+            RoleSessionName='ComplianceAutomationSession'
+            )
+        remote_credentials_cache[remote_account_id] = response['Credentials']
+        return response['Credentials']
 
-        obj = s3.Object(template_bucket_name, key)
-        template = obj.get()['Body'].read().decode('utf-8')
+def get_remote_client(service, remote_account_id, region):
+    credentials = get_remote_credentials(remote_account_id)
 
-        #Check if the remote Rule template is empty.  If it is, use the default Rule template.
-        #template_key = key
-        if not template:
-            default_obj = s3.Object(template_bucket_name, default_template_name)
-            template = default_obj.get()['Body'].read().decode('utf-8')
+    # The client is reused as long as the credentials of the account are not renewed.
+    cache_key = (remote_account_id, region, service)
+    with cache_lock:
+        cached_client = remote_client_cache.get(cache_key)
+    if cached_client and cached_client['Credentials'] is credentials:
+        return cached_client['Client']
 
-        remote_session = None
-        try:
-            remote_sts_client = boto3.client('sts')
-            response = remote_sts_client.assume_role(
-                RoleArn='arn:aws:iam::'+remote_account_id+':role/' + remote_execution_path_name + remote_execution_role_name,
-                RoleSessionName='ComplianceAutomationSession'
-                )
+    # Creating clients from a shared session is not thread-safe, so each client gets its own session and is built
+    # without holding any lock. Using the clients is thread-safe.
+    client = boto3.session.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken'],
+        region_name=region
+    ).client(service)
+    with cache_lock:
+        remote_client_cache[cache_key] = {'Credentials': credentials, 'Client': client}
+    return client
 
-            remote_session = boto3.Session(
-                aws_access_key_id=response['Credentials']['AccessKeyId'],
-                aws_secret_access_key=response['Credentials']['SecretAccessKey'],
-                aws_session_token=response['Credentials']['SessionToken']
-            )
-        except Exception as e3:
-            print("Failed to assume role into remote account. " + str(e3))
+def get_template(template_bucket_name, key):
+    return s3_client.get_object(Bucket=template_bucket_name, Key=key)['Body'].read().decode('utf-8')
+
+def list_account_templates(template_bucket_name):
+    # Yield the template objects page by page, only from the root of the bucket (the Delimiter leaves out csv/, export-state/, ...).
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=template_bucket_name, Delimiter='/'):
+        for s3_object in page.get('Contents', []):
+            #Assumes S3 template keys are of the form <12-digit-account-id>.json
+            if not re.match('^[0-9]{12}\.json$', s3_object["Key"]):
+                #Skip this one
+                print("Skipping " + s3_object["Key"])
+                continue
+            yield s3_object
+
+def get_deploy_manifest(region, template_bucket_name):
+    # The manifest records, for each account, the digest of the template last deployed successfully.
+    try:
+        return json.loads(get_template(template_bucket_name, deploy_manifest_name))
+    except s3_client.exceptions.NoSuchKey:
+        return {}
+    except Exception as e:
+        log(region, None, "Failed to get the deployment manifest, all the accounts are deployed. " + str(e))
+        return {}
+
+def put_deploy_manifest(region, template_bucket_name, deploy_manifest):
+    try:
+        s3_client.put_object(Bucket=template_bucket_name, Key=deploy_manifest_name, Body=json.dumps(deploy_manifest, sort_keys=True), ContentType='application/json')
+    except Exception as e:
+        log(region, None, "Failed to put the deployment manifest. " + str(e))
+
+def get_account_waves():
+    # Return the wave number of each account, per region ("*" for the accounts listed without region).
+    account_waves = {}
+    if account_list_location == 'none':
+        return account_waves
+
+    # Without a readable account list, or with an invalid wave tag, the accounts are deployed in the last wave.
+    try:
+        account_list_bucket, account_list_key = account_list_location.split('/', 1)
+        account_list = json.loads(get_template(account_list_bucket, account_list_key))
+    except Exception as e:
+        log(main_region, None, "Failed to get the account list, all the accounts are deployed in one wave. " + str(e))
+        return account_waves
+
+    for account in account_list.get('AllAccounts', []):
+        for tag in account.get('Tags', []):
+            if tag.startswith(rollout_wave_tag_prefix):
+                try:
+                    account_waves[(account['AccountID'], account.get('Region', '*'))] = int(tag[len(rollout_wave_tag_prefix):])
+                except ValueError:
+                    log(main_region, account['AccountID'], "Invalid wave tag \"" + tag + "\", the account is deployed in the last wave.")
+    return account_waves
+
+def get_rollout_waves(region, list_of_accounts):
+    # Return the accounts grouped by wave, in the order of the waves.
+    waves = {}
+    for remote_account_id in list_of_accounts:
+        wave = account_waves.get((remote_account_id, region), account_waves.get((remote_account_id, '*'), sys.maxsize))
+        waves.setdefault(wave, []).append(remote_account_id)
+    return [sorted(waves[wave]) for wave in sorted(waves)]
+
+def is_crawler_rule_compliant(region, remote_account_id, since):
+    # Return True once the crawler Rule has recorded a COMPLIANT result after the given time, False if NON_COMPLIANT or after the timeout.
+    poll_delay = 15
+    deadline = time.time() + rollout_health_gate_timeout
+    while time.time() < deadline:
+        time.sleep(poll_delay)
+        poll_delay = min(poll_delay * 2, 60)
+        try:
+            config_client = get_remote_client("config", remote_account_id, region)
+            results = config_client.get_compliance_details_by_config_rule(ConfigRuleName=initial_deployed_rule)['EvaluationResults']
+        except Exception as e:
+            log(region, remote_account_id, "Error when getting the result of the crawler Rule: " + str(e))
             continue
+        for result in results:
+            if result['ResultRecordedTime'] > since:
+                log(region, remote_account_id, "Crawler Rule result: " + result['ComplianceType'])
+                return result['ComplianceType'] == 'COMPLIANT'
+    log(region, remote_account_id, "No result of the crawler Rule after the timeout.")
+    return False
+
+def is_wave_healthy(region, wave, account_status, since):
+    # A wave is healthy if all its stacks are deployed and, with the health gate, if all its crawler Rules are COMPLIANT.
+    if "FAILED" in [account_status[remote_account_id] for remote_account_id in wave]:
+        log(region, None, "Some stacks of the wave are not deployed.")
+        return False
+
+    if rollout_health_gate:
+        list_of_account_deployed = [remote_account_id for remote_account_id in wave if account_status[remote_account_id] in ["UPDATED", "CREATED"]]
+        with ThreadPoolExecutor(max_workers=max_concurrent_accounts) as executor:
+            health_checks = [executor.submit(is_crawler_rule_compliant, region, remote_account_id, since) for remote_account_id in list_of_account_deployed]
+            if not all([health_check.result() for health_check in health_checks]):
+                log(region, None, "Some crawler Rules of the wave are not COMPLIANT.")
+                return False
+
+    time.sleep(rollout_wave_pause)
+    return True
+
+class DeployCheckpoint():
+    """Save the progress of the deployment of a region in its template bucket.
 
-        cfn = remote_session.client("cloudformation", region_name=region)
+    Keyword arguments:
+    region -- the region deployed
+    template_bucket_name -- the template bucket of the region
+    template_digests -- the digest of the template of each account, filled by the listing
+    """
+    def __init__(self, region, template_bucket_name, template_digests):
+        self.region = region
+        self.template_bucket_name = template_bucket_name
+        self.template_digests = template_digests
+        self.accounts = {}
+        self.unsaved = False
+        self.last_write_time = time.time()
+
+    def load(self):
+        # Return the digest of the template of the accounts completed by the previous run, if it was interrupted.
         try:
-            print("Attempting to update Rule stack.")
-            update_response = cfn.update_stack(
-                StackName=stack_name,
-                TemplateBody=template,
-                Parameters=[
-                    {
-                        'ParameterKey': 'LambdaAccountId',
-                        'ParameterValue': central_account_id
-                    }
-                ],
-                Capabilities=['CAPABILITY_NAMED_IAM']
-            )
-            print("Update triggered for " + remote_account_id + ".")
-            list_of_account_to_review.append(remote_account_id)
+            checkpoint = json.loads(get_template(self.template_bucket_name, deploy_checkpoint_name))
+        except s3_client.exceptions.NoSuchKey:
+            return {}
         except Exception as e:
-            if "No updates are to be performed." in str(e):
-                print("Stack already up-to-date.")
-                continue
+            log(self.region, None, "Failed to get the deployment checkpoint, all the accounts are deployed. " + str(e))
+            return {}
 
-            if "does not exist" in str(e):
-                try:
-                    print("Stack not found. Attempting to create Rule stack.")
-                    create_response = cfn.create_stack(
-                        StackName=stack_name,
-                        TemplateBody=template,
-                        Parameters=[
-                            {
-                                'ParameterKey': 'LambdaAccountId',
-                                'ParameterValue': central_account_id
-                            }
-                        ],
-                        Capabilities=['CAPABILITY_NAMED_IAM']
-                    )
-                    print("Creation triggered for " + remote_account_id + ".")
-                    list_of_account_to_review.append(remote_account_id)
-                    continue
-                except Exception as e2:
-                    print("Error creating new stack: " + str(e2))
-
-            print("Error no condition matched: " + str(e))
-
-    if not list_of_account_to_review:
-        continue
-
-    time.sleep(20)
-
-    for remote_account_id in list_of_account_to_review:
-        remote_session = None
+        if checkpoint['Completed']:
+            return {}
+        return {remote_account_id: account['Digest'] for remote_account_id, account in checkpoint['Accounts'].items() if account['Status'] in ["UPDATED", "CREATED", "UNCHANGED", "SKIPPED"]}
+
+    def record(self, remote_account_id, status):
+        self.accounts[remote_account_id] = {'Status': status, 'Digest': self.template_digests[remote_account_id]}
+        self.unsaved = True
+        if time.time() - self.last_write_time > checkpoint_interval:
+            self.write()
+
+    def flush(self):
+        # Save the accounts recorded since the last write, whatever the CHECKPOINT_INTERVAL (i.e. at the end of a wave).
+        if self.unsaved:
+            self.write()
+
+    def write(self, completed=False):
+        self.unsaved = False
+        self.last_write_time = time.time()
         try:
-            remote_sts_client = boto3.client('sts')
-            response = remote_sts_client.assume_role(
-                RoleArn='arn:aws:iam::'+remote_account_id+':role/' + remote_execution_path_name + remote_execution_role_name,
-                RoleSessionName='ComplianceAutomationTriggerRuleSession'
+            s3_client.put_object(Bucket=self.template_bucket_name, Key=deploy_checkpoint_name, Body=json.dumps({'Completed': completed, 'Accounts': self.accounts}, sort_keys=True), ContentType='application/json')
+        except Exception as e:
+            log(self.region, None, "Failed to put the deployment checkpoint. " + str(e))
+
+def deploy_account(region, template_bucket_name, s3_object, default_template):
+    # Return the status of the stack deployment: UPDATED, CREATED, UNCHANGED or FAILED.
+    remote_account_id = s3_object["Key"].split(".")[0]
+    try:
+        #Check if the remote Rule template is empty.  If it is, use the default Rule template.
+        template = default_template
+        if s3_object["Size"]:
+            template = get_template(template_bucket_name, s3_object["Key"])
+    except Exception as e4:
+        log(region, remote_account_id, "Failed to get the Rule template. " + str(e4))
+        return "FAILED"
+
+    try:
+        cfn = get_remote_client("cloudformation", remote_account_id, region)
+    except Exception as e3:
+        log(region, remote_account_id, "Failed to assume role into remote account. " + str(e3))
+        return "FAILED"
+
+    try:
+        log(region, remote_account_id, "Attempting to update Rule stack.")
+        cfn.update_stack(
+            StackName=stack_name,
+            TemplateBody=template,
+            Parameters=[
+                {
+                    'ParameterKey': 'LambdaAccountId',
+                    'ParameterValue': central_account_id
+                }
+            ],
+            Capabilities=['CAPABILITY_NAMED_IAM']
+        )
+        log(region, remote_account_id, "Update triggered.")
+        return "UPDATED"
+    except Exception as e:
+        if "No updates are to be performed." in str(e):
+            log(region, remote_account_id, "Stack already up-to-date.")
+            return "UNCHANGED"
+
+        if "does not exist" in str(e):
+            try:
+                log(region, remote_account_id, "Stack not found. Attempting to create Rule stack.")
+                cfn.create_stack(
+                    StackName=stack_name,
+                    TemplateBody=template,
+                    Parameters=[
+                        {
+                            'ParameterKey': 'LambdaAccountId',
+                            'ParameterValue': central_account_id
+                        }
+                    ],
+                    Capabilities=['CAPABILITY_NAMED_IAM']
                 )
+                log(region, remote_account_id, "Creation triggered.")
+                return "CREATED"
+            except Exception as e2:
+                log(region, remote_account_id, "Error creating new stack: " + str(e2))
+                return "FAILED"
 
-            remote_session = boto3.Session(
-                aws_access_key_id=response['Credentials']['AccessKeyId'],
-                aws_secret_access_key=response['Credentials']['SecretAccessKey'],
-                aws_session_token=response['Credentials']['SessionToken']
-            )
-        except Exception as e3:
-            print("Failed to assume role into remote account. " + str(e3))
-            continue
+        log(region, remote_account_id, "Error no condition matched: " + str(e))
+        return "FAILED"
+
+def delete_previous_change_sets(cfn):
+    # The change sets of the previous runs are deleted, whether they were reviewed or not.
+    paginator = cfn.get_paginator('list_change_sets')
+    for page in paginator.paginate(StackName=stack_name):
+        for change_set in page['Summaries']:
+            if change_set['ChangeSetName'].startswith(change_set_prefix):
+                cfn.delete_change_set(StackName=stack_name, ChangeSetName=change_set['ChangeSetName'])
+
+def wait_for_change_set(cfn):
+    # Return the change set once created, with all its changes, or None if still in progress after the timeout.
+    poll_delay = 1
+    deadline = time.time() + stack_poll_timeout
+    while time.time() < deadline:
+        time.sleep(poll_delay)
+        poll_delay = min(poll_delay * 2, stack_poll_max_delay)
+        change_set = cfn.describe_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        if change_set['Status'] in ['CREATE_COMPLETE', 'FAILED']:
+            next_token = change_set.get('NextToken')
+            while next_token:
+                change_set_part = cfn.describe_change_set(StackName=stack_name, ChangeSetName=change_set_name, NextToken=next_token)
+                change_set['Changes'] += change_set_part['Changes']
+                next_token = change_set_part.get('NextToken')
+            return change_set
+    return None
+
+def preview_account(region, template_bucket_name, s3_object, default_template):
+    # Return the status of the change set (PREVIEWED, UNCHANGED or FAILED), its type and its resource changes.
+    remote_account_id = s3_object["Key"].split(".")[0]
+    try:
+        #Check if the remote Rule template is empty.  If it is, use the default Rule template.
+        template = default_template
+        if s3_object["Size"]:
+            template = get_template(template_bucket_name, s3_object["Key"])
+    except Exception as e4:
+        log(region, remote_account_id, "Failed to get the Rule template. " + str(e4))
+        return "FAILED", None, []
+
+    try:
+        cfn = get_remote_client("cloudformation", remote_account_id, region)
+    except Exception as e3:
+        log(region, remote_account_id, "Failed to assume role into remote account. " + str(e3))
+        return "FAILED", None, []
+
+    try:
+        change_set_type = "UPDATE"
+        try:
+            # A stack created by a change set not yet executed is in REVIEW_IN_PROGRESS.
+            if cfn.describe_stacks(StackName=stack_name)['Stacks'][0]['StackStatus'] == 'REVIEW_IN_PROGRESS':
+                change_set_type = "CREATE"
+            delete_previous_change_sets(cfn)
+        except Exception as e:
+            if "does not exist" not in str(e):
+                raise
+            change_set_type = "CREATE"
+
+        log(region, remote_account_id, "Attempting to create a change set of type " + change_set_type + ".")
+        cfn.create_change_set(
+            StackName=stack_name,
+            TemplateBody=template,
+            Parameters=[
+                {
+                    'ParameterKey': 'LambdaAccountId',
+                    'ParameterValue': central_account_id
+                }
+            ],
+            Capabilities=['CAPABILITY_NAMED_IAM'],
+            ChangeSetName=change_set_name,
+            ChangeSetType=change_set_type
+        )
+        change_set = wait_for_change_set(cfn)
+    except Exception as e:
+        log(region, remote_account_id, "Error when creating the change set: " + str(e))
+        return "FAILED", None, []
+
+    if not change_set:
+        log(region, remote_account_id, "Change set still in progress after the timeout.")
+        return "FAILED", None, []
+
+    if change_set['Status'] == 'FAILED':
+        reason = change_set.get('StatusReason', '')
+        if "didn't contain changes" in reason or "No updates are to be performed." in reason:
+            # The empty change sets are deleted right away.
+            log(region, remote_account_id, "Stack already up-to-date.")
+            try:
+                cfn.delete_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+            except Exception as e:
+                log(region, remote_account_id, "Error when deleting the empty change set: " + str(e))
+            return "UNCHANGED", None, []
+        log(region, remote_account_id, "Change set failed: " + reason)
+        return "FAILED", None, []
+
+    changes = [change['ResourceChange'] for change in change_set['Changes']]
+    log(region, remote_account_id, "Change set created with " + str(len(changes)) + " resource change(s).")
+    return "PREVIEWED", change_set_type, changes
+
+def execute_change_set(region, remote_account_id, change_set_type):
+    # Return the status of the stack deployment: UPDATED, CREATED or FAILED.
+    try:
+        cfn = get_remote_client("cloudformation", remote_account_id, region)
+        log(region, remote_account_id, "Attempting to execute the change set.")
+        cfn.execute_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+    except Exception as e:
+        log(region, remote_account_id, "Error when executing the change set: " + str(e))
+        return "FAILED"
+
+    return track_stack(region, remote_account_id, "CREATED" if change_set_type == "CREATE" else "UPDATED")
+
+def execute_region_change_sets(region, account_status, change_sets, checkpoint):
+    # The change sets are executed by waves of at most CHANGESET_WAVE_SIZE accounts, a wave starts once the previous one is healthy.
+    # If a wave is not healthy, the next waves are not executed and their change sets are left for review.
+    waves = []
+    for rollout_wave in get_rollout_waves(region, change_sets):
+        waves += [rollout_wave[wave_start:wave_start + change_set_wave_size] for wave_start in range(0, len(rollout_wave), change_set_wave_size)]
 
-        config_client = remote_session.client("config", region_name=region)
+    with ThreadPoolExecutor(max_workers=max_concurrent_accounts) as executor:
+        for wave_number, wave in enumerate(waves):
+            log(region, None, "Executing the change sets of wave " + str(wave_number + 1) + " (" + str(len(wave)) + " account(s)).")
+            wave_start_time = datetime.datetime.now(datetime.timezone.utc)
+            executions = {remote_account_id: executor.submit(execute_change_set, region, remote_account_id, change_sets[remote_account_id][0]) for remote_account_id in wave}
+            for remote_account_id, execution in executions.items():
+                account_status[remote_account_id] = execution.result()
+                checkpoint.record(remote_account_id, account_status[remote_account_id])
+            checkpoint.flush()
+            if wave_number + 1 < len(waves) and not is_wave_healthy(region, wave, account_status, wave_start_time):
+                log(region, None, "The next waves are not executed.")
+                break
+
+def wait_for_stack(region, remote_account_id):
+    # Return the terminal status of the stack, or None if it is still in progress after the timeout.
+    poll_delay = stack_poll_initial_delay
+    deadline = time.time() + stack_poll_timeout
+    while time.time() < deadline:
+        time.sleep(poll_delay)
+        poll_delay = min(poll_delay * 2, stack_poll_max_delay)
         try:
-            print("Attempting to trigger the crawler Rule.")
-            config_client.start_config_rules_evaluation(ConfigRuleNames=[initial_deployed_rule])
+            cfn = get_remote_client("cloudformation", remote_account_id, region)
+            stack_status = cfn.describe_stacks(StackName=stack_name)['Stacks'][0]['StackStatus']
         except Exception as e:
-            print("Error when triggering the crawler Rule: " + str(e))
+            log(region, remote_account_id, "Error when describing the Rule stack: " + str(e))
+            continue
+        if not stack_status.endswith('_IN_PROGRESS'):
+            return stack_status
+    return None
+
+def trigger_crawler_rule(region, remote_account_id):
+    try:
+        config_client = get_remote_client("config", remote_account_id, region)
+        log(region, remote_account_id, "Attempting to trigger the crawler Rule.")
+        config_client.start_config_rules_evaluation(ConfigRuleNames=[initial_deployed_rule])
+    except Exception as e:
+        log(region, remote_account_id, "Error when triggering the crawler Rule: " + str(e))
+
+def track_stack(region, remote_account_id, status):
+    # The crawler Rule is triggered as soon as the stack is deployed, never on a stack still in progress or rolled back.
+    stack_status = wait_for_stack(region, remote_account_id)
+    if stack_status not in stack_success_status:
+        log(region, remote_account_id, "Rule stack not deployed, status: " + str(stack_status))
+        return "FAILED"
+
+    log(region, remote_account_id, "Rule stack deployed, status: " + stack_status)
+    trigger_crawler_rule(region, remote_account_id)
+    return status
+
+def deploy_wave(region, template_bucket_name, s3_objects, default_template, account_status, change_sets, checkpoint):
+    # A failure in one account never stops the deployment of the other accounts.
+    # The accounts are submitted while they are listed, so that the template downloads overlap with the deployments.
+    with ThreadPoolExecutor(max_workers=max_concurrent_accounts) as executor, ThreadPoolExecutor(max_workers=max_concurrent_accounts) as tracker:
+        deployments = {}
+        for s3_object in s3_objects:
+            remote_account_id = s3_object["Key"].split(".")[0]
+            if deploy_mode == 'CHANGESET':
+                deployments[executor.submit(preview_account, region, template_bucket_name, s3_object, default_template)] = remote_account_id
+            else:
+                deployments[executor.submit(deploy_account, region, template_bucket_name, s3_object, default_template)] = remote_account_id
+
+        trackings = {}
+        for deployment in as_completed(deployments):
+            remote_account_id = deployments[deployment]
+            if deploy_mode == 'CHANGESET':
+                status, change_set_type, changes = deployment.result()
+                if status == "PREVIEWED":
+                    change_sets[remote_account_id] = (change_set_type, changes)
+                account_status[remote_account_id] = status
+                checkpoint.record(remote_account_id, status)
+                continue
+
+            status = deployment.result()
+            if status in ["UPDATED", "CREATED"]:
+                trackings[tracker.submit(track_stack, region, remote_account_id, status)] = remote_account_id
+            else:
+                account_status[remote_account_id] = status
+                checkpoint.record(remote_account_id, status)
+        for tracking in as_completed(trackings):
+            remote_account_id = trackings[tracking]
+            account_status[remote_account_id] = tracking.result()
+            checkpoint.record(remote_account_id, account_status[remote_account_id])
+    checkpoint.flush()
+
+def list_changed_templates(region, template_bucket_name, default_template_digest, account_status, template_digests, checkpoint):
+    deploy_manifest = {}
+    if not force_deploy:
+        deploy_manifest = get_deploy_manifest(region, template_bucket_name)
+
+    resumed_accounts = {}
+    if deploy_resume:
+        resumed_accounts = checkpoint.load()
+
+    for s3_object in list_account_templates(template_bucket_name):
+        remote_account_id = s3_object["Key"].split(".")[0]
+
+        # The ETag is the digest of the template content, an empty template stands for the default template.
+        template_digests[remote_account_id] = s3_object["ETag"] if s3_object["Size"] else "default:" + default_template_digest
+        if deploy_manifest.get(remote_account_id) == template_digests[remote_account_id]:
+            log(region, remote_account_id, "Rule template unchanged since the last deployment, skipped.")
+            account_status[remote_account_id] = "SKIPPED"
+            checkpoint.record(remote_account_id, "SKIPPED")
+            continue
+
+        if resumed_accounts.get(remote_account_id) == template_digests[remote_account_id]:
+            log(region, remote_account_id, "Rule template already deployed by the interrupted run, skipped.")
+            account_status[remote_account_id] = "SKIPPED"
+            checkpoint.record(remote_account_id, "SKIPPED")
+            continue
+
+        yield s3_object
+
+def deploy_region(region):
+    # Return the status of the deployment of each account of the region, the digests of their templates and their change sets.
+    template_bucket_name = template_bucket_name_prefix + '-' + region
+
+    # The default template is fetched once for all the empty templates of the region.
+    default_template_obj = s3_client.get_object(Bucket=template_bucket_name, Key=default_template_name)
+    default_template = default_template_obj['Body'].read().decode('utf-8')
+
+    account_status = {}
+    template_digests = {}
+    change_sets = {}
+    checkpoint = DeployCheckpoint(region, template_bucket_name, template_digests)
+    region_checkpoints[region] = checkpoint
+    changed_templates = list_changed_templates(region, template_bucket_name, default_template_obj["ETag"], account_status, template_digests, checkpoint)
+
+    # The change sets are only created here, their execution is done by waves once all the regions are previewed.
+    if not account_waves or deploy_mode == 'CHANGESET':
+        deploy_wave(region, template_bucket_name, changed_templates, default_template, account_status, change_sets, checkpoint)
+        return account_status, template_digests, change_sets
+
+    # With waves, all the templates are listed before the first wave starts.
+    s3_objects = {s3_object["Key"].split(".")[0]: s3_object for s3_object in changed_templates}
+    waves = get_rollout_waves(region, s3_objects)
+    for wave_number, wave in enumerate(waves):
+        log(region, None, "Deploying wave " + str(wave_number + 1) + " (" + str(len(wave)) + " account(s)).")
+        wave_start_time = datetime.datetime.now(datetime.timezone.utc)
+        deploy_wave(region, template_bucket_name, [s3_objects[remote_account_id] for remote_account_id in wave], default_template, account_status, change_sets, checkpoint)
+        if wave_number + 1 < len(waves) and not is_wave_healthy(region, wave, account_status, wave_start_time):
+            log(region, None, "The next waves are held.")
+            for held_wave in waves[wave_number + 1:]:
+                for remote_account_id in held_wave:
+                    account_status[remote_account_id] = "HELD"
+                    checkpoint.record(remote_account_id, "HELD")
+            break
+
+    checkpoint.flush()
+    return account_status, template_digests, change_sets
+
+def update_deploy_manifest(region, account_status, template_digests):
+    # The failed accounts, and those with a change set not executed, are left out of the manifest so that they are deployed again at the next run.
+    new_deploy_manifest = {}
+    for remote_account_id, digest in template_digests.items():
+        if account_status[remote_account_id] in ["UPDATED", "CREATED", "UNCHANGED", "SKIPPED"]:
+            new_deploy_manifest[remote_account_id] = digest
+    put_deploy_manifest(region, template_bucket_name_prefix + '-' + region, new_deploy_manifest)
+
+def report_change_sets(region_change_sets):
+    # The changes of all the accounts are grouped by resource, to review the whole fleet at once.
+    fleet_report = {}
+    for region in all_region_list:
+        for remote_account_id, (change_set_type, changes) in sorted(region_change_sets.get(region, {}).items()):
+            for change in changes:
+                resource_change = change['Action'] + " " + change['ResourceType'] + " " + change['LogicalResourceId']
+                if change.get('Replacement') == 'True':
+                    resource_change += " (replacement)"
+                fleet_report.setdefault(resource_change, []).append(remote_account_id + " (" + region + ")")
+
+    print("Change set report (" + change_set_name + "):")
+    for resource_change, deployments in sorted(fleet_report.items()):
+        print("  " + resource_change + ": " + str(len(deployments)) + " account(s)")
+        for deployment in deployments:
+            print("    " + deployment)
+
+    try:
+        s3_client.put_object(
+            Bucket=template_bucket_name_prefix + '-' + main_region,
+            Key=change_set_report_prefix + change_set_name + ".json",
+            Body=json.dumps({region: {remote_account_id: changes for remote_account_id, (change_set_type, changes) in change_sets.items()} for region, change_sets in region_change_sets.items()}, sort_keys=True, default=str),
+            ContentType='application/json'
+            )
+    except Exception as e:
+        log(main_region, None, "Failed to put the change set report. " + str(e))
+
+def print_summary(region_status):
+    print("Deployment summary:")
+    for status in ["UPDATED", "CREATED", "UNCHANGED", "SKIPPED", "PREVIEWED", "HELD", "FAILED"]:
+        deployments = []
+        for region in all_region_list:
+            deployments += [remote_account_id + " (" + region + ")" for remote_account_id, account_status in sorted(region_status.get(region, {}).items()) if account_status == status]
+        print("  " + status + ": " + str(len(deployments)))
+        for deployment in deployments:
+            print("    " + deployment)
+
+# The deployment only runs when the script is executed, so that its functions can be tested.
+if __name__ == '__main__':
+    account_waves = get_account_waves()
+
+    region_status = {}
+    region_checkpoints = {}
+    region_template_digests = {}
+    region_change_sets = {}
+    with ThreadPoolExecutor(max_workers=max_concurrent_regions) as region_executor:
+        region_deployments = {region: region_executor.submit(deploy_region, region) for region in all_region_list}
+        for region, region_deployment in region_deployments.items():
+            try:
+                region_status[region], region_template_digests[region], region_change_sets[region] = region_deployment.result()
+            except Exception as e5:
+                log(region, None, "Failed to deploy the region. " + str(e5))
+
+    if deploy_mode == 'CHANGESET':
+        report_change_sets(region_change_sets)
+
+        if change_set_execute:
+            with ThreadPoolExecutor(max_workers=max_concurrent_regions) as region_executor:
+                region_executions = {region: region_executor.submit(execute_region_change_sets, region, region_status[region], change_sets, region_checkpoints[region]) for region, change_sets in region_change_sets.items()}
+                for region, region_execution in region_executions.items():
+                    try:
+                        region_execution.result()
+                    except Exception as e6:
+                        log(region, None, "Failed to execute the change sets of the region. " + str(e6))
+
+    for region in region_status:
+        update_deploy_manifest(region, region_status[region], region_template_digests[region])
+        region_checkpoints[region].write(completed=True)
+
+    print_summary(region_status)
 
-sys.exit(0)
+    sys.exit(0)
@@ -0,0 +1,170 @@
+import sys
+import io
+import json
+import unittest
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    import mock
+    from mock import MagicMock, patch
+
+#############
+# Main Code #
+#############
+
+class NoSuchKey(Exception):
+    pass
+
+s3_client_mock = MagicMock()
+s3_client_mock.exceptions.NoSuchKey = NoSuchKey
+sts_client_mock = MagicMock()
+sts_client_mock.get_caller_identity = MagicMock(return_value={'Account': '999999999999'})
+
+class SessionMock():
+    def client(self, client_name, *args, **kwargs):
+        if client_name == 's3':
+            return s3_client_mock
+        elif client_name == 'sts':
+            return sts_client_mock
+        else:
+            raise Exception("Attempting to create an unknown client")
+
+class Boto3Mock():
+    class session():
+        Session = SessionMock
+
+sys.modules['boto3'] = Boto3Mock()
+
+# The arguments of the script: main region, template bucket prefix, initial deployed Rule and other regions.
+script_argv = sys.argv
+sys.argv = ['deploy_rule_templates.py', 'us-east-1', 'template-bucket', 'INITIAL_RULE', 'none']
+deploy = __import__('deploy_rule_templates')
+sys.argv = script_argv
+
+TEMPLATE_BUCKET = 'template-bucket-us-east-1'
+
+class S3TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.s3_objects = {}
+        s3_client_mock.reset_mock()
+        s3_client_mock.get_object = MagicMock(side_effect=self.get_object)
+        s3_client_mock.put_object = MagicMock(side_effect=self.put_object)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.s3_objects:
+            raise NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.s3_objects[(Bucket, Key)].encode('utf-8'))}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.s3_objects[(Bucket, Key)] = Body
+
+    def get_checkpoint(self):
+        return json.loads(self.s3_objects[(TEMPLATE_BUCKET, deploy.deploy_checkpoint_name)])
+
+class DeployCheckpointTest(S3TestCase):
+
+    def test_recorded_accounts_written_after_interval(self):
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, {'111111111111': 'digest-1', '222222222222': 'digest-2'})
+        checkpoint.record('111111111111', 'UPDATED')
+        s3_client_mock.put_object.assert_not_called()
+
+        checkpoint.last_write_time = 0
+        checkpoint.record('222222222222', 'FAILED')
+        self.assertEqual({'Completed': False, 'Accounts': {
+            '111111111111': {'Status': 'UPDATED', 'Digest': 'digest-1'},
+            '222222222222': {'Status': 'FAILED', 'Digest': 'digest-2'}}}, self.get_checkpoint())
+
+    def test_flush_writes_only_unsaved_accounts(self):
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, {'111111111111': 'digest-1'})
+        checkpoint.flush()
+        s3_client_mock.put_object.assert_not_called()
+
+        checkpoint.record('111111111111', 'CREATED')
+        checkpoint.flush()
+        checkpoint.flush()
+        s3_client_mock.put_object.assert_called_once()
+        self.assertEqual({'Status': 'CREATED', 'Digest': 'digest-1'}, self.get_checkpoint()['Accounts']['111111111111'])
+
+    def test_load_completed_accounts_of_interrupted_run(self):
+        self.s3_objects[(TEMPLATE_BUCKET, deploy.deploy_checkpoint_name)] = json.dumps({'Completed': False, 'Accounts': {
+            '111111111111': {'Status': 'UPDATED', 'Digest': 'digest-1'},
+            '222222222222': {'Status': 'FAILED', 'Digest': 'digest-2'},
+            '333333333333': {'Status': 'SKIPPED', 'Digest': 'digest-3'}}})
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, {})
+        self.assertEqual({'111111111111': 'digest-1', '333333333333': 'digest-3'}, checkpoint.load())
+
+    def test_load_ignores_completed_run(self):
+        self.s3_objects[(TEMPLATE_BUCKET, deploy.deploy_checkpoint_name)] = json.dumps({'Completed': True, 'Accounts': {
+            '111111111111': {'Status': 'UPDATED', 'Digest': 'digest-1'}}})
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, {})
+        self.assertEqual({}, checkpoint.load())
+
+    def test_load_without_checkpoint(self):
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, {})
+        self.assertEqual({}, checkpoint.load())
+
+class ResumeTest(S3TestCase):
+
+    def test_accounts_completed_with_same_template_skipped(self):
+        self.s3_objects[(TEMPLATE_BUCKET, deploy.deploy_checkpoint_name)] = json.dumps({'Completed': False, 'Accounts': {
+            '111111111111': {'Status': 'UPDATED', 'Digest': 'etag-1'},
+            '222222222222': {'Status': 'UPDATED', 'Digest': 'old-etag-2'},
+            '333333333333': {'Status': 'FAILED', 'Digest': 'etag-3'}}})
+        s3_objects = [build_template_object('111111111111', 'etag-1'), build_template_object('222222222222', 'etag-2'), build_template_object('333333333333', 'etag-3')]
+        account_status = {}
+        template_digests = {}
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, template_digests)
+        with patch.object(deploy, 'list_account_templates', return_value=s3_objects):
+            changed_templates = list(deploy.list_changed_templates('us-east-1', TEMPLATE_BUCKET, 'default-etag', account_status, template_digests, checkpoint))
+
+        self.assertEqual(['222222222222.json', '333333333333.json'], [s3_object['Key'] for s3_object in changed_templates])
+        self.assertEqual({'111111111111': 'SKIPPED'}, account_status)
+
+    def test_accounts_deployed_again_without_resume(self):
+        self.s3_objects[(TEMPLATE_BUCKET, deploy.deploy_checkpoint_name)] = json.dumps({'Completed': False, 'Accounts': {
+            '111111111111': {'Status': 'UPDATED', 'Digest': 'etag-1'}}})
+        template_digests = {}
+        checkpoint = deploy.DeployCheckpoint('us-east-1', TEMPLATE_BUCKET, template_digests)
+        with patch.object(deploy, 'deploy_resume', False), \
+        patch.object(deploy, 'list_account_templates', return_value=[build_template_object('111111111111', 'etag-1')]):
+            changed_templates = list(deploy.list_changed_templates('us-east-1', TEMPLATE_BUCKET, 'default-etag', {}, template_digests, checkpoint))
+        self.assertEqual(['111111111111.json'], [s3_object['Key'] for s3_object in changed_templates])
+
+@patch.object(deploy, 'account_list_location', 'account-list-bucket/account_list.json')
+class AccountWavesTest(S3TestCase):
+
+    def put_account_list(self, accounts):
+        self.s3_objects[('account-list-bucket', 'account_list.json')] = json.dumps({'AllAccounts': accounts})
+
+    def test_wave_tags_parsed(self):
+        self.put_account_list([
+            {'AccountID': '111111111111', 'Tags': ['baseline', 'wave:1']},
+            {'AccountID': '222222222222', 'Region': 'eu-west-1', 'Tags': ['wave:2']},
+            {'AccountID': '333333333333', 'Tags': ['baseline']}])
+        self.assertEqual({('111111111111', '*'): 1, ('222222222222', 'eu-west-1'): 2}, deploy.get_account_waves())
+
+    def test_invalid_wave_tags_ignored(self):
+        self.put_account_list([
+            {'AccountID': '111111111111', 'Tags': ['wave:x']},
+            {'AccountID': '222222222222', 'Tags': ['wave:']},
+            {'AccountID': '333333333333', 'Tags': ['wave:3']}])
+        self.assertEqual({('333333333333', '*'): 3}, deploy.get_account_waves())
+
+    def test_unreadable_account_list(self):
+        self.assertEqual({}, deploy.get_account_waves())
+        self.s3_objects[('account-list-bucket', 'account_list.json')] = 'not json'
+        self.assertEqual({}, deploy.get_account_waves())
+
+    def test_accounts_without_wave_in_last_wave(self):
+        account_waves = {('111111111111', '*'): 2, ('222222222222', 'us-east-1'): 1, ('222222222222', '*'): 3}
+        with patch.object(deploy, 'account_waves', account_waves, create=True):
+            rollout_waves = deploy.get_rollout_waves('us-east-1', ['444444444444', '111111111111', '222222222222', '333333333333'])
+        self.assertEqual([['222222222222'], ['111111111111'], ['333333333333', '444444444444']], rollout_waves)
+
+####################
+# Helper Functions #
+####################
+
+def build_template_object(remote_account_id, etag, size=100):
+    return {'Key': remote_account_id + '.json', 'ETag': etag, 'Size': size}
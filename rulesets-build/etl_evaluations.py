@@ -1,9 +1,12 @@
 import base64
 import json
 import datetime
+import io
 import os
+import time
 import zipfile
 import boto3
+import botocore
 
 # DEFINE WHITELIST & RULESET LOCATION
 # Define the Bucket prefix where the ruleset.zip and whitelist are posted in the Compliance Account.
@@ -11,6 +14,9 @@ BUCKET_PREFIX = 'compliance-engine-codebuild-source'
 ORIGINAL_ZIP_RULES = 'ruleset.zip'
 ORIGINAL_ZIP_RULES_FOLDER = 'rules'
 FILE_NAME_RULE_PARAMETER = 'parameters.json'
+# Local copy of the RuleSets of each rule, with the ETag of the ruleset.zip they were read from.
+LOCAL_RULES_PARAMETERS = '/tmp/rules_parameters.json'
+LOCAL_RULES_VERSION = '/tmp/rules_parameters.etag'
 
 # RULESET PARAMETERS
 # Define the delimiter in the ruleset.txt
@@ -24,45 +30,204 @@ DELIMITER_MULTI = ','
 # KEEPING ATHENA QUERIES UP TO DATE
 CODEBUILD_TEMPLATE_NAME = 'Compliance-Rule-Template-Build'
 CODEPIPELINE_NAME = 'Compliance-Engine-Pipeline'
+# The ruleset definition is revalidated against S3 (ETag) once the TTL (in seconds) has expired. CodeBuild and CodePipeline
+# are reconciled only once per version of the definition, either 'inline' or in an 'async' invocation of this function.
+# A successful sync writes the version in the SCHEMA_SYNCED_VERSION object of the ruleset bucket. Until a container finds
+# the version there, it requests the sync again once per TTL.
+RULESET_DEFINITION_CACHE_TTL = int(os.environ.get('RulesetDefinitionCacheTTL', '300'))
+SCHEMA_SYNC_MODE = os.environ.get('SchemaSyncMode', 'async')
+SCHEMA_SYNCED_VERSION = 'schema_synced_version.txt'
+
+# PARQUET OUTPUT
+# When the DatalakeOutputFormat is PARQUET, Firehose converts the records using the schema of this Glue table.
+DATALAKE_OUTPUT_FORMAT = os.environ.get('DatalakeOutputFormat', 'JSON')
+GLUE_DATABASE_NAME = 'complianceascode'
+GLUE_TABLE_NAME = 'events_parquet'
+PARQUET_FOLDER = 'compliance-as-code-events-parquet'
+
+# PARTITIONING
+# When enabled, Firehose partitions the events by date, account and region. The account and region are given by the ETL.
+DATALAKE_PARTITIONING = os.environ.get('DatalakePartitioning', 'false') == 'true'
+
+# WHITELIST CACHE
+# The parsed whitelist is kept for the life of the warm container. Once the TTL (in seconds) has expired,
+# it is revalidated against S3 with a conditional GET on the ETag, so unchanged whitelists are not downloaded again.
+# The whitelist is kept as an index of (ConfigRuleArn, ResourceId) to the latest ValidUntil date. A failed load is
+# also kept until the TTL has expired: the previous index is served if there is one, the error is raised otherwise.
+WHITELIST_CACHE_TTL = int(os.environ.get('ComplianceWhitelistCacheTTL', '300'))
+WHITELIST_CACHE = {
+    'Key': None,
+    'ETag': None,
+    'Index': None,
+    'Error': None,
+    'LastValidated': 0
+    }
+WHITELIST_CACHE_STATS = {
+    'Hits': 0,
+    'Misses': 0
+    }
+
+# RULESET CACHE
+RULESET_DEFINITION_CACHE = {
+    'ETag': None,
+    'Definition': None,
+    'LastValidated': 0,
+    'SyncedETag': None,
+    'SyncRequestedETag': None,
+    'SyncRequestedTime': 0
+    }
+# RuleSets of each rule, as read from the ruleset.zip identified by the ETag.
+RULES_PARAMETERS = {
+    'ETag': None,
+    'RuleSets': {}
+    }
+# Ruleset columns of each rule, computed once per version of the ruleset.zip and of the ruleset definition.
+RULE_COLUMNS_CACHE = {
+    'Version': None,
+    'Columns': {}
+    }
 
 S3_CLIENT = boto3.client('s3')
 
+def build_whitelist_index(whitelist_json):
+    today = datetime.datetime.today().date()
+    whitelist_index = {}
+    for whitelist_item in whitelist_json["Whitelist"]:
+        for whitelisted_resources in whitelist_item["WhitelistedResources"]:
+            if not whitelisted_resources.get("ApprovalTicket"):
+                continue
+            # A malformed entry is skipped, the rest of the whitelist still applies.
+            try:
+                valid_until = datetime.datetime.strptime(whitelisted_resources["ValidUntil"], '%Y-%m-%d').date()
+                # Expired exceptions are pruned
+                if valid_until < today:
+                    continue
+                for resource_id in whitelisted_resources["ResourceIds"]:
+                    index_key = (whitelist_item["ConfigRuleArn"], resource_id)
+                    if index_key not in whitelist_index or whitelist_index[index_key] < valid_until:
+                        whitelist_index[index_key] = valid_until
+            except Exception as ex:
+                print("Whitelist entry skipped for {}: {}".format(whitelist_item.get("ConfigRuleArn"), str(ex)))
+    return whitelist_index
+
+def get_whitelist_index(whitelist_key):
+    if WHITELIST_CACHE['Key'] != whitelist_key:
+        WHITELIST_CACHE.update({'Key': whitelist_key, 'ETag': None, 'Index': None, 'Error': None, 'LastValidated': 0})
+
+    # S3 is not called again before the TTL has expired, whatever the outcome of the last call.
+    now = time.time()
+    if now - WHITELIST_CACHE['LastValidated'] < WHITELIST_CACHE_TTL:
+        if WHITELIST_CACHE['Index'] is None:
+            raise Exception("The whitelist could not be loaded: " + WHITELIST_CACHE['Error'])
+        WHITELIST_CACHE_STATS['Hits'] += 1
+        return WHITELIST_CACHE['Index']
+
+    bucket_wl = whitelist_key.split("/")[0]
+    key_wl = "/".join(whitelist_key.split("/")[1:])
+    WHITELIST_CACHE['LastValidated'] = now
+    try:
+        if WHITELIST_CACHE['Index'] is not None and WHITELIST_CACHE['ETag']:
+            object_wl = S3_CLIENT.get_object(Bucket=bucket_wl, Key=key_wl, IfNoneMatch=WHITELIST_CACHE['ETag'])
+        else:
+            object_wl = S3_CLIENT.get_object(Bucket=bucket_wl, Key=key_wl)
+        whitelist_index = build_whitelist_index(json.loads(object_wl["Body"].read().decode("utf-8")))
+    except Exception as ex:
+        if WHITELIST_CACHE['Index'] is None:
+            WHITELIST_CACHE['Error'] = str(ex)
+            raise
+        if not (isinstance(ex, botocore.exceptions.ClientError) and ex.response['Error']['Code'] in ['304', 'NotModified']):
+            print("Whitelist refresh failed, the previous whitelist is kept: {}".format(str(ex)))
+        WHITELIST_CACHE_STATS['Hits'] += 1
+        return WHITELIST_CACHE['Index']
+
+    WHITELIST_CACHE_STATS['Misses'] += 1
+    WHITELIST_CACHE['ETag'] = object_wl['ETag']
+    WHITELIST_CACHE['Index'] = whitelist_index
+    WHITELIST_CACHE['Error'] = None
+    return whitelist_index
+
 def is_compliance_result_whitelisted(result):
     try:
         whitelist_key = os.environ['ComplianceWhitelist']
         if whitelist_key == 'none':
             return False
-        bucket_wl = whitelist_key.split("/")[0]
-        key_wl = "/".join(whitelist_key.split("/")[1:])
-        object_wl = S3_CLIENT.get_object(Bucket=bucket_wl, Key=key_wl)
-        whitelist_json = json.loads(object_wl["Body"].read().decode("utf-8"))
-
-        for whitelist_item in whitelist_json["Whitelist"]:
-            if whitelist_item["ConfigRuleArn"] == result["ConfigRuleArn"]:
-                for whitelisted_resources in whitelist_item["WhitelistedResources"]:
-                    if result["ResourceId"] in whitelisted_resources["ResourceIds"] \
-                    and whitelisted_resources["ApprovalTicket"] \
-                    and datetime.datetime.today().date() <= datetime.datetime.strptime(whitelisted_resources["ValidUntil"], '%Y-%m-%d').date():
-                        print(result["ResourceId"] + " whitelisted for " + result["ConfigRuleArn"] + ".")
-                        return True
+        whitelist_index = get_whitelist_index(whitelist_key)
+
+        valid_until = whitelist_index.get((result["ConfigRuleArn"], result["ResourceId"]))
+        if valid_until and datetime.datetime.today().date() <= valid_until:
+            print(result["ResourceId"] + " whitelisted for " + result["ConfigRuleArn"] + ".")
+            return True
         return False
     except Exception as ex:
         print("Whitelisting review went wrong: {}".format(str(ex)))
         return False
 
 def download_rules_parameters_locally(bucket):
-    s3_resource = boto3.resource('s3')
-    local_file_name = '/tmp/' + ORIGINAL_ZIP_RULES
-    s3_resource.Bucket(bucket).download_file(ORIGINAL_ZIP_RULES, local_file_name)
+    local_version = None
+    if os.path.isfile(LOCAL_RULES_VERSION) and os.path.isfile(LOCAL_RULES_PARAMETERS):
+        with open(LOCAL_RULES_VERSION) as infile:
+            local_version = infile.read()
 
-    with zipfile.ZipFile(local_file_name, 'r') as zip_ref:
-        zip_ref.extractall('/tmp/')
+    try:
+        if local_version:
+            object_rules = S3_CLIENT.get_object(Bucket=bucket, Key=ORIGINAL_ZIP_RULES, IfNoneMatch=local_version)
+        else:
+            object_rules = S3_CLIENT.get_object(Bucket=bucket, Key=ORIGINAL_ZIP_RULES)
+    except botocore.exceptions.ClientError as ex:
+        if local_version and ex.response['Error']['Code'] in ['304', 'NotModified']:
+            # ruleset.zip unchanged, use the local copy
+            if RULES_PARAMETERS['ETag'] != local_version:
+                with open(LOCAL_RULES_PARAMETERS) as infile:
+                    RULES_PARAMETERS['RuleSets'] = json.load(infile)
+                RULES_PARAMETERS['ETag'] = local_version
+            return local_version
+        raise
+
+    # Only the parameters.json of each rule is needed, read them from the zip in memory.
+    rules_rulesets = {}
+    with zipfile.ZipFile(io.BytesIO(object_rules["Body"].read()), 'r') as zip_ref:
+        for member_name in zip_ref.namelist():
+            member_path = member_name.split('/')
+            if len(member_path) != 3 \
+            or member_path[0] != ORIGINAL_ZIP_RULES_FOLDER \
+            or member_path[2] != FILE_NAME_RULE_PARAMETER:
+                continue
+            parameters = json.loads(zip_ref.read(member_name).decode("utf-8"))
+            rules_rulesets[member_path[1]] = parameters['Parameters'].get('RuleSets', [])
 
-    return True
+    with open(LOCAL_RULES_PARAMETERS, 'w') as outfile:
+        json.dump(rules_rulesets, outfile)
+    # The version marker is written last, so that it never points to an incomplete local copy.
+    with open(LOCAL_RULES_VERSION, 'w') as outfile:
+        outfile.write(object_rules['ETag'])
+
+    RULES_PARAMETERS['RuleSets'] = rules_rulesets
+    RULES_PARAMETERS['ETag'] = object_rules['ETag']
+    return object_rules['ETag']
 
 def get_ruleset_definition(bucket):
-    object_rs = S3_CLIENT.get_object(Bucket=bucket, Key=RULESET_LIST)
-    ruleset_str = object_rs["Body"].read().decode("utf-8")
+    now = time.time()
+    if RULESET_DEFINITION_CACHE['Definition'] is not None \
+    and now - RULESET_DEFINITION_CACHE['LastValidated'] < RULESET_DEFINITION_CACHE_TTL:
+        return RULESET_DEFINITION_CACHE['Definition'], RULESET_DEFINITION_CACHE['ETag']
+
+    try:
+        if RULESET_DEFINITION_CACHE['ETag']:
+            object_rs = S3_CLIENT.get_object(Bucket=bucket, Key=RULESET_LIST, IfNoneMatch=RULESET_DEFINITION_CACHE['ETag'])
+        else:
+            object_rs = S3_CLIENT.get_object(Bucket=bucket, Key=RULESET_LIST)
+    except botocore.exceptions.ClientError as ex:
+        if RULESET_DEFINITION_CACHE['ETag'] and ex.response['Error']['Code'] in ['304', 'NotModified']:
+            RULESET_DEFINITION_CACHE['LastValidated'] = now
+            return RULESET_DEFINITION_CACHE['Definition'], RULESET_DEFINITION_CACHE['ETag']
+        raise
+
+    RULESET_DEFINITION_CACHE['Definition'] = parse_ruleset_definition(object_rs["Body"].read().decode("utf-8"))
+    RULESET_DEFINITION_CACHE['ETag'] = object_rs['ETag']
+    RULESET_DEFINITION_CACHE['LastValidated'] = now
+    return RULESET_DEFINITION_CACHE['Definition'], RULESET_DEFINITION_CACHE['ETag']
+
+def parse_ruleset_definition(ruleset_str):
     ruleset_list_unprocessed = ruleset_str.replace('\n', ' ').split(DELIMITER_IN_RULESET_LIST)
     ruleset_list = []
 
@@ -86,53 +251,107 @@ def get_ruleset_definition(bucket):
     return ruleset_list
 
 def get_rule_rulesets(rule_name):
-    with open('/tmp/' + ORIGINAL_ZIP_RULES_FOLDER + '/' + rule_name + '/' + FILE_NAME_RULE_PARAMETER) as infile:
-        parameters = json.load(infile)
+    return RULES_PARAMETERS['RuleSets'][rule_name]
 
+def build_rule_columns(rule_rulesets, ruleset_definition_list):
+    single_rulesets = set()
     #in case, multi-value
-    all_ruleset_categories = []
-    return_ruleset = []
+    multi_rulesets = {}
 
-    for ruleset in parameters['Parameters']['RuleSets']:
+    for ruleset in rule_rulesets:
         if DELIMITER_IN_RULESET not in ruleset:
-            return_ruleset.append(ruleset)
-
-        if ruleset.split(DELIMITER_IN_RULESET)[0] in all_ruleset_categories:
+            single_rulesets.add(ruleset)
+            multi_rulesets.setdefault(ruleset, [])
             continue
-        all_ruleset_categories.append(ruleset.split(DELIMITER_IN_RULESET)[0])
+        ruleset_details = ruleset.split(DELIMITER_IN_RULESET)
+        multi_rulesets.setdefault(ruleset_details[0], []).append(ruleset_details[1])
 
-        value_ruleset = []
-        for ruleset_second in parameters['Parameters']['RuleSets']:
-            if DELIMITER_IN_RULESET not in ruleset_second:
-                continue
-            if ruleset.split(DELIMITER_IN_RULESET)[0] == ruleset_second.split(DELIMITER_IN_RULESET)[0]:
-                value_ruleset.append(ruleset_second.split(DELIMITER_IN_RULESET)[1])
-        value_ruleset.sort()
-        return_ruleset.append(ruleset.split(DELIMITER_IN_RULESET)[0]+DELIMITER_IN_RULESET+DELIMITER_MULTI.join(value_ruleset))
+    rule_columns = {}
+    for ruleset in ruleset_definition_list:
+        ruleset_name = ruleset['RulesetName']
+        if not ruleset['MultiValue']:
+            rule_columns[ruleset_name] = 'True' if ruleset_name in single_rulesets else 'False'
+        elif ruleset_name in multi_rulesets:
+            rule_columns[ruleset_name] = DELIMITER_MULTI.join(sorted(multi_rulesets[ruleset_name]))
+        else:
+            # no rule_ruleset matched, meaning not present
+            rule_columns[ruleset_name] = 'False'
+    return rule_columns
 
-    return return_ruleset
+def get_rule_columns(rule_name, ruleset_definition_list, rules_version):
+    if RULE_COLUMNS_CACHE['Version'] != rules_version:
+        RULE_COLUMNS_CACHE['Version'] = rules_version
+        RULE_COLUMNS_CACHE['Columns'] = {}
 
-def add_ruleset_fields(etl_data, ruleset_definition_list, rule_rulesets_list):
-    for ruleset in ruleset_definition_list:
-        etl_data[ruleset["RulesetName"]] = get_value_for_rule(rule_rulesets_list, ruleset)
+    if rule_name not in RULE_COLUMNS_CACHE['Columns']:
+        RULE_COLUMNS_CACHE['Columns'][rule_name] = build_rule_columns(get_rule_rulesets(rule_name), ruleset_definition_list)
+    return RULE_COLUMNS_CACHE['Columns'][rule_name]
+
+def add_ruleset_fields(etl_data, rule_columns):
+    etl_data.update(rule_columns)
     return etl_data
 
-def get_value_for_rule(rule_rulesets_list, ruleset):
-    if not ruleset['MultiValue']:
-        if ruleset['RulesetName'] not in rule_rulesets_list:
-            return 'False'
-        return 'True'
+def get_column_list(ruleset_definition_list):
+    commun_col = [
+        'ConfigRuleArn',
+        'EngineRecordedTime',
+        'ConfigRuleName',
+        'ResourceType',
+        'ResourceId',
+        'ResultRecordedTime',
+        'ConfigRuleInvokedTime',
+        'AccountId',
+        'AwsRegion',
+        'Annotation',
+        'ComplianceType',
+        'WhitelistedComplianceType']
+
+    all_col = []
+    all_col += commun_col
+    for ruleset_definition in ruleset_definition_list:
+        all_col.append(ruleset_definition['RulesetName'])
+    return all_col
+
+def update_glue_table(ruleset_definition_list):
+    glue_client = boto3.client('glue')
+    location = 's3://' + os.environ['ComplianceEventBucket'] + '/' + PARQUET_FOLDER + '/'
+    # Firehose matches the JSON keys to the columns case insensitively.
+    columns = [{'Name': col.lower(), 'Type': 'string'} for col in get_column_list(ruleset_definition_list)]
+    table_input = {
+        'Name': GLUE_TABLE_NAME,
+        'TableType': 'EXTERNAL_TABLE',
+        'Parameters': {
+            'classification': 'parquet',
+            'EXTERNAL': 'TRUE'
+            },
+        'StorageDescriptor': {
+            'Columns': columns,
+            'Location': location,
+            'InputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+            'OutputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+            'SerdeInfo': {
+                'SerializationLibrary': 'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe',
+                'Parameters': {'serialization.format': '1'}
+                }
+            }
+        }
 
-    for each_rule_ruleset in rule_rulesets_list:
-        try:
-            if each_rule_ruleset.split(DELIMITER_IN_RULESET)[0] == ruleset['RulesetName']:
-                return each_rule_ruleset.split(DELIMITER_IN_RULESET)[1]
-        except:
-            # Not splitable, meaning not multivalue
-            continue
+    try:
+        glue_client.create_database(DatabaseInput={'Name': GLUE_DATABASE_NAME})
+    except glue_client.exceptions.AlreadyExistsException:
+        pass
+
+    try:
+        current_table = glue_client.get_table(DatabaseName=GLUE_DATABASE_NAME, Name=GLUE_TABLE_NAME)
+    except glue_client.exceptions.EntityNotFoundException:
+        glue_client.create_table(DatabaseName=GLUE_DATABASE_NAME, TableInput=table_input)
+        return True
 
-    # no rule_ruleset matched, meaning not present
-    return 'False'
+    current_columns = [{'Name': col['Name'], 'Type': col['Type']} for col in current_table['Table']['StorageDescriptor']['Columns']]
+    if current_columns == columns:
+        return False
+    glue_client.update_table(DatabaseName=GLUE_DATABASE_NAME, TableInput=table_input)
+    return True
 
 def update_codebuild_param(ruleset_definition_list):
     codebuild_client = boto3.client('codebuild')
@@ -152,24 +371,7 @@ def update_codebuild_param(ruleset_definition_list):
             continue
         env_variables_new_list.append(env_var)
 
-    commun_col = [
-        'ConfigRuleArn',
-        'EngineRecordedTime',
-        'ConfigRuleName',
-        'ResourceType',
-        'ResourceId',
-        'ResultRecordedTime',
-        'ConfigRuleInvokedTime',
-        'AccountId',
-        'AwsRegion',
-        'Annotation',
-        'ComplianceType',
-        'WhitelistedComplianceType']
-
-    all_col = []
-    all_col += commun_col
-    for ruleset_definition in ruleset_definition_list:
-        all_col.append(ruleset_definition['RulesetName'])
+    all_col = get_column_list(ruleset_definition_list)
     new_value_firehose_key = ','.join(all_col)
 
     if current_value['FIREHOSE_KEY_LIST'] != new_value_firehose_key:
@@ -207,22 +409,92 @@ def update_codebuild_param(ruleset_definition_list):
 
     return False
 
-def lambda_handler(event, context):
-    compliance_account_id = context.invoked_function_arn.split(":")[4]
-    compliance_account_region = context.invoked_function_arn.split(":")[3]
-    artifact_bucket = "-".join([BUCKET_PREFIX, compliance_account_id, compliance_account_region])
-    ruleset_bucket = "-".join([BUCKET_PREFIX_RULESET_TXT, compliance_account_id, compliance_account_region])
-
-    download_rules_parameters_locally(artifact_bucket)
+def sync_schema(ruleset_definition_list):
+    # Return True if the schema is synchronized.
+    synced = True
+    if DATALAKE_OUTPUT_FORMAT == 'PARQUET':
+        try:
+            update_glue_table(ruleset_definition_list)
+        except Exception as e:
+            print('Error not able to update the Glue table: ' + str(e))
+            synced = False
 
-    ruleset_definition_list = []
-    ruleset_definition_list = get_ruleset_definition(ruleset_bucket)
     if update_codebuild_param(ruleset_definition_list):
         try:
             codepipeline_client = boto3.client('codepipeline')
             codepipeline_client.start_pipeline_execution(name=CODEPIPELINE_NAME)
         except Exception as e:
             print('Error not able to trigger the codepipeline: ' + str(e))
+            synced = False
+    return synced
+
+def get_synced_version(bucket):
+    try:
+        return S3_CLIENT.get_object(Bucket=bucket, Key=SCHEMA_SYNCED_VERSION)["Body"].read().decode("utf-8")
+    except Exception as e:
+        if not (isinstance(e, botocore.exceptions.ClientError) and e.response['Error']['Code'] == 'NoSuchKey'):
+            print('Error not able to get the synchronized schema version: ' + str(e))
+        return None
+
+def record_synced_version(bucket, ruleset_version):
+    RULESET_DEFINITION_CACHE['SyncedETag'] = ruleset_version
+    try:
+        S3_CLIENT.put_object(Bucket=bucket, Key=SCHEMA_SYNCED_VERSION, Body=ruleset_version.encode("utf-8"))
+    except Exception as e:
+        print('Error not able to put the synchronized schema version: ' + str(e))
+
+def request_schema_sync(context, ruleset_bucket, ruleset_definition_list, ruleset_version):
+    if RULESET_DEFINITION_CACHE['SyncedETag'] == ruleset_version:
+        return
+
+    # Until its sync is confirmed, a version is checked and requested at most once per TTL.
+    now = time.time()
+    if RULESET_DEFINITION_CACHE['SyncRequestedETag'] == ruleset_version \
+    and now - RULESET_DEFINITION_CACHE['SyncRequestedTime'] < RULESET_DEFINITION_CACHE_TTL:
+        return
+    RULESET_DEFINITION_CACHE['SyncRequestedETag'] = ruleset_version
+    RULESET_DEFINITION_CACHE['SyncRequestedTime'] = now
+
+    if get_synced_version(ruleset_bucket) == ruleset_version:
+        RULESET_DEFINITION_CACHE['SyncedETag'] = ruleset_version
+        return
+
+    try:
+        if SCHEMA_SYNC_MODE == 'inline':
+            if sync_schema(ruleset_definition_list):
+                record_synced_version(ruleset_bucket, ruleset_version)
+        else:
+            lambda_client = boto3.client('lambda')
+            lambda_client.invoke(
+                FunctionName=context.invoked_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps({'SchemaSync': True}))
+    except Exception as e:
+        print('Error not able to synchronize the schema: ' + str(e))
+
+def lambda_handler(event, context):
+    compliance_account_id = context.invoked_function_arn.split(":")[4]
+    compliance_account_region = context.invoked_function_arn.split(":")[3]
+    artifact_bucket = "-".join([BUCKET_PREFIX, compliance_account_id, compliance_account_region])
+    ruleset_bucket = "-".join([BUCKET_PREFIX_RULESET_TXT, compliance_account_id, compliance_account_region])
+
+    ruleset_definition_list, ruleset_version = get_ruleset_definition(ruleset_bucket)
+
+    # Asynchronous invocation of this function, requested by request_schema_sync()
+    if event.get('SchemaSync'):
+        if not sync_schema(ruleset_definition_list):
+            # Raised so that Lambda retries the asynchronous invocation.
+            raise Exception('Error not able to synchronize the schema.')
+        record_synced_version(ruleset_bucket, ruleset_version)
+        return {}
+
+    request_schema_sync(context, ruleset_bucket, ruleset_definition_list, ruleset_version)
+
+    rules_parameters_version = download_rules_parameters_locally(artifact_bucket)
+    rules_version = (rules_parameters_version, ruleset_version)
+
+    WHITELIST_CACHE_STATS['Hits'] = 0
+    WHITELIST_CACHE_STATS['Misses'] = 0
 
     output = []
     for record in event['records']:
@@ -248,13 +520,22 @@ def lambda_handler(event, context):
         else:
             etl_data["WhitelistedComplianceType"] = 'False'
 
-        rule_rulesets_list = get_rule_rulesets(etl_data["ConfigRuleName"])
-        etl_data = add_ruleset_fields(etl_data, ruleset_definition_list, rule_rulesets_list)
+        rule_columns = get_rule_columns(etl_data["ConfigRuleName"], ruleset_definition_list, rules_version)
+        etl_data = add_ruleset_fields(etl_data, rule_columns)
         data_to_return = json.dumps(etl_data) + '\n'
         output_record = {
             'recordId': record['recordId'],
             'result': 'Ok',
             'data': base64.b64encode(data_to_return.encode('utf-8')).decode("utf-8")
             }
+        if DATALAKE_PARTITIONING:
+            output_record['metadata'] = {
+                'partitionKeys': {
+                    'account': etl_data['AccountId'],
+                    'region': etl_data['AwsRegion']
+                    }
+                }
         output.append(output_record)
+
+    print("Whitelist cache: {} hit(s), {} miss(es).".format(WHITELIST_CACHE_STATS['Hits'], WHITELIST_CACHE_STATS['Misses']))
     return {'records': output}
@@ -0,0 +1,178 @@
+import sys
+import io
+import json
+import unittest
+try:
+    from unittest.mock import MagicMock, patch
+except ImportError:
+    import mock
+    from mock import MagicMock, patch
+import botocore
+from botocore.exceptions import ClientError
+
+#############
+# Main Code #
+#############
+
+s3_client_mock = MagicMock()
+lambda_client_mock = MagicMock()
+
+class Boto3Mock():
+    def client(self, client_name, *args, **kwargs):
+        if client_name == 's3':
+            return s3_client_mock
+        elif client_name == 'lambda':
+            return lambda_client_mock
+        else:
+            raise Exception("Attempting to create an unknown client")
+
+sys.modules['boto3'] = Boto3Mock()
+
+etl = __import__('etl_evaluations')
+
+WHITELIST_KEY = 'whitelist-bucket/compliance-whitelist.json'
+
+class WhitelistIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        etl.WHITELIST_CACHE.update({'Key': None, 'ETag': None, 'Index': None, 'Error': None, 'LastValidated': 0})
+        s3_client_mock.reset_mock()
+        s3_client_mock.get_object = MagicMock(return_value=build_whitelist_object('"etag-1"', 'resource-1'))
+
+    def test_index_reused_until_ttl(self):
+        index = etl.get_whitelist_index(WHITELIST_KEY)
+        self.assertIn(('rule-arn', 'resource-1'), index)
+        self.assertIs(index, etl.get_whitelist_index(WHITELIST_KEY))
+        s3_client_mock.get_object.assert_called_once_with(Bucket='whitelist-bucket', Key='compliance-whitelist.json')
+
+    def test_index_revalidated_with_etag_after_ttl(self):
+        index = etl.get_whitelist_index(WHITELIST_KEY)
+        expire_whitelist_cache()
+        s3_client_mock.get_object = MagicMock(side_effect=build_client_error('304'))
+        self.assertIs(index, etl.get_whitelist_index(WHITELIST_KEY))
+        s3_client_mock.get_object.assert_called_once_with(Bucket='whitelist-bucket', Key='compliance-whitelist.json', IfNoneMatch='"etag-1"')
+
+    def test_index_reloaded_when_changed(self):
+        etl.get_whitelist_index(WHITELIST_KEY)
+        expire_whitelist_cache()
+        s3_client_mock.get_object = MagicMock(return_value=build_whitelist_object('"etag-2"', 'resource-2'))
+        index = etl.get_whitelist_index(WHITELIST_KEY)
+        self.assertEqual([('rule-arn', 'resource-2')], list(index.keys()))
+        self.assertEqual('"etag-2"', etl.WHITELIST_CACHE['ETag'])
+
+    def test_failed_refresh_keeps_previous_index(self):
+        index = etl.get_whitelist_index(WHITELIST_KEY)
+        expire_whitelist_cache()
+        s3_client_mock.get_object = MagicMock(side_effect=build_client_error('SlowDown'))
+        self.assertIs(index, etl.get_whitelist_index(WHITELIST_KEY))
+        self.assertIs(index, etl.get_whitelist_index(WHITELIST_KEY))
+        s3_client_mock.get_object.assert_called_once()
+
+    def test_malformed_entry_skipped(self):
+        whitelist = {"Whitelist": [
+            {"ConfigRuleArn": "rule-arn", "WhitelistedResources": [
+                {"ResourceIds": ["resource-1"], "ApprovalTicket": "ticket", "ValidUntil": "not-a-date"},
+                {"ResourceIds": ["resource-2"], "ApprovalTicket": "ticket", "ValidUntil": "2099-01-01"}]}]}
+        self.assertEqual([('rule-arn', 'resource-2')], list(etl.build_whitelist_index(whitelist).keys()))
+
+@patch.dict('os.environ', {'ComplianceWhitelist': WHITELIST_KEY})
+class WhitelistedResultTest(unittest.TestCase):
+
+    def setUp(self):
+        etl.WHITELIST_CACHE.update({'Key': None, 'ETag': None, 'Index': None, 'Error': None, 'LastValidated': 0})
+        s3_client_mock.reset_mock()
+        s3_client_mock.get_object = MagicMock(return_value=build_whitelist_object('"etag-1"', 'resource-1'))
+
+    def test_whitelisted_result(self):
+        self.assertTrue(etl.is_compliance_result_whitelisted({'ConfigRuleArn': 'rule-arn', 'ResourceId': 'resource-1'}))
+        self.assertFalse(etl.is_compliance_result_whitelisted({'ConfigRuleArn': 'rule-arn', 'ResourceId': 'resource-2'}))
+        s3_client_mock.get_object.assert_called_once()
+
+    def test_failed_load_cached_until_ttl(self):
+        s3_client_mock.get_object = MagicMock(side_effect=build_client_error('AccessDenied'))
+        for _ in range(3):
+            self.assertFalse(etl.is_compliance_result_whitelisted({'ConfigRuleArn': 'rule-arn', 'ResourceId': 'resource-1'}))
+        s3_client_mock.get_object.assert_called_once()
+
+        expire_whitelist_cache()
+        s3_client_mock.get_object = MagicMock(return_value=build_whitelist_object('"etag-1"', 'resource-1'))
+        self.assertTrue(etl.is_compliance_result_whitelisted({'ConfigRuleArn': 'rule-arn', 'ResourceId': 'resource-1'}))
+
+class SchemaSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        etl.RULESET_DEFINITION_CACHE.update({'SyncedETag': None, 'SyncRequestedETag': None, 'SyncRequestedTime': 0})
+        self.s3_objects = {}
+        s3_client_mock.reset_mock()
+        s3_client_mock.get_object = MagicMock(side_effect=self.get_object)
+        s3_client_mock.put_object = MagicMock(side_effect=self.put_object)
+        lambda_client_mock.reset_mock()
+        lambda_client_mock.invoke = MagicMock(return_value={'StatusCode': 202})
+        self.context = MagicMock(invoked_function_arn='arn:aws:lambda:us-east-1:123456789012:function:ComplianceEngine-ETL')
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.s3_objects:
+            raise build_client_error('NoSuchKey')
+        return {'Body': io.BytesIO(self.s3_objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.s3_objects[(Bucket, Key)] = Body
+
+    def test_async_sync_not_recorded_when_queued(self):
+        etl.request_schema_sync(self.context, 'ruleset-bucket', [], 'version-1')
+        lambda_client_mock.invoke.assert_called_once()
+        self.assertIsNone(etl.RULESET_DEFINITION_CACHE['SyncedETag'])
+
+        # Requested again only once the TTL has expired, as long as the sync is not confirmed.
+        etl.request_schema_sync(self.context, 'ruleset-bucket', [], 'version-1')
+        lambda_client_mock.invoke.assert_called_once()
+        etl.RULESET_DEFINITION_CACHE['SyncRequestedTime'] = 0
+        etl.request_schema_sync(self.context, 'ruleset-bucket', [], 'version-1')
+        self.assertEqual(2, lambda_client_mock.invoke.call_count)
+
+    def test_sync_recorded_by_schema_sync_invocation(self):
+        with patch.object(etl, 'get_ruleset_definition', return_value=([], 'version-1')), \
+        patch.object(etl, 'sync_schema', return_value=True):
+            etl.lambda_handler({'SchemaSync': True}, self.context)
+        self.assertEqual(b'version-1', self.s3_objects[('compliance-engine-codebuild-output-123456789012-us-east-1', etl.SCHEMA_SYNCED_VERSION)])
+
+        # Another container finds the synchronized version and does not request the sync.
+        etl.RULESET_DEFINITION_CACHE.update({'SyncedETag': None, 'SyncRequestedETag': None, 'SyncRequestedTime': 0})
+        etl.request_schema_sync(self.context, 'compliance-engine-codebuild-output-123456789012-us-east-1', [], 'version-1')
+        lambda_client_mock.invoke.assert_not_called()
+        self.assertEqual('version-1', etl.RULESET_DEFINITION_CACHE['SyncedETag'])
+
+    def test_failed_schema_sync_invocation_raised(self):
+        with patch.object(etl, 'get_ruleset_definition', return_value=([], 'version-1')), \
+        patch.object(etl, 'sync_schema', return_value=False):
+            self.assertRaises(Exception, etl.lambda_handler, {'SchemaSync': True}, self.context)
+        self.assertEqual({}, self.s3_objects)
+
+    @patch.object(etl, 'SCHEMA_SYNC_MODE', 'inline')
+    def test_inline_sync_recorded_only_when_successful(self):
+        with patch.object(etl, 'sync_schema', return_value=False):
+            etl.request_schema_sync(self.context, 'ruleset-bucket', [], 'version-1')
+        self.assertIsNone(etl.RULESET_DEFINITION_CACHE['SyncedETag'])
+        self.assertEqual({}, self.s3_objects)
+
+        etl.RULESET_DEFINITION_CACHE['SyncRequestedTime'] = 0
+        with patch.object(etl, 'sync_schema', return_value=True):
+            etl.request_schema_sync(self.context, 'ruleset-bucket', [], 'version-1')
+        self.assertEqual('version-1', etl.RULESET_DEFINITION_CACHE['SyncedETag'])
+        self.assertEqual(b'version-1', self.s3_objects[('ruleset-bucket', etl.SCHEMA_SYNCED_VERSION)])
+        lambda_client_mock.invoke.assert_not_called()
+
+####################
+# Helper Functions #
+####################
+
+def build_whitelist_object(etag, resource_id, valid_until='2099-01-01'):
+    whitelist = {"Whitelist": [{"ConfigRuleArn": "rule-arn", "WhitelistedResources": [
+        {"ResourceIds": [resource_id], "ApprovalTicket": "ticket", "ValidUntil": valid_until}]}]}
+    return {'ETag': etag, 'Body': io.BytesIO(json.dumps(whitelist).encode('utf-8'))}
+
+def build_client_error(code):
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': 'error-message'}}, 'GetObject')
+
+def expire_whitelist_cache():
+    etl.WHITELIST_CACHE['LastValidated'] = 0
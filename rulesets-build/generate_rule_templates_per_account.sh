@@ -2,7 +2,7 @@
 
 OTHER_REGIONS=$1
 if [ "$OTHER_REGIONS" != "none" ]; then
-  cat account_list.json | jq -r '.AllAccounts[] | ([.AccountID , .Region, (.Tags | join(","))] | join(" "))' > wellformedlist.txt
+  cat account_list.json | jq -r '.AllAccounts[] | ([.AccountID , .Region, (.Tags | map(select(startswith("wave:") | not)) | join(","))] | join(" "))' > wellformedlist.txt
 
   cd rules
   while IFS=' ' read -ra line; do
@@ -16,7 +16,7 @@ if [ "$OTHER_REGIONS" != "none" ]; then
     aws s3 cp ${template_file_name} s3://$3-$regionname/${template_file_name}
   done < ../wellformedlist.txt
 else
-  cat account_list.json | jq -r '.AllAccounts[] | ([.AccountID , (.Tags | join(","))] | join(" "))' > wellformedlist.txt
+  cat account_list.json | jq -r '.AllAccounts[] | ([.AccountID , (.Tags | map(select(startswith("wave:") | not)) | join(","))] | join(" "))' > wellformedlist.txt
 
   cd rules
   while IFS=' ' read -ra line; do